@@ -8,6 +8,7 @@ import logging
 import numpy as np
 import pandas as pd
 import unicodedata
+from functools import lru_cache
 from core.normalize import apply_alias_series
 
 log = logging.getLogger("ptcgp")
@@ -15,15 +16,28 @@ log = logging.getLogger("ptcgp")
 REQUIRED_RAW = {"Deck A", "Deck B", "W", "L", "T"}
 
 
+def _counts_col(s: pd.Series, *, clip: bool = True) -> pd.Series:
+    """Colonna conteggi → Int64 (non numerici = 0, negativi clippati a 0 se clip).
+    Tra uno stadio e l'altro i conteggi sono già interi: to_numeric solo se serve.
+    """
+    if pd.api.types.is_integer_dtype(s.dtype):
+        v = s.fillna(0) if s.hasnans else s
+    else:
+        v = pd.to_numeric(s, errors="coerce").fillna(0)
+    if clip:
+        v = v.clip(lower=0)
+    return v.astype("Int64")
+
+
 def _coerce_counts(df: pd.DataFrame) -> pd.DataFrame:
-    d = df.copy()
-    for c in ("W", "L", "T"):
-        d[c] = pd.to_numeric(d[c], errors="coerce").fillna(0).clip(lower=0).astype("Int64")
-    d["Deck A"] = d["Deck A"].astype(str).str.strip()
-    d["Deck B"] = d["Deck B"].astype(str).str.strip()
-    # N verità
-    d["N"] = (d["W"] + d["L"] + d["T"]).astype("Int64")
-    return d
+    # solo le colonne necessarie, senza copiare l'intero frame
+    W, L, T = (_counts_col(df[c]) for c in ("W", "L", "T"))
+    return pd.DataFrame({
+        "Deck A": df["Deck A"].astype(str).str.strip(),
+        "Deck B": df["Deck B"].astype(str).str.strip(),
+        "W": W, "L": L, "T": T,
+        "N": (W + L + T).astype("Int64"),  # N verità
+    }, index=df.index)
 
 
 def maxN_flat(df_raw: pd.DataFrame) -> pd.DataFrame:
@@ -36,33 +50,44 @@ def maxN_flat(df_raw: pd.DataFrame) -> pd.DataFrame:
         raise KeyError(f"Mancano colonne in df_matchup_raw: {missing}")
 
     d = _coerce_counts(df_raw)
+    if d.empty:
+        return pd.DataFrame()
+
+    # id di gruppo in ordine di prima apparizione + righe con N massimo nel gruppo
+    grp = d.groupby(["Deck A", "Deck B"], sort=False)
+    d["_g"] = grp.ngroup()
+    top = d[d["N"] == grp["N"].transform("max")]
+
+    # riga unica → passa così com'è; tie → somma W/L/T (un solo groupby vettoriale)
+    df_flat = top.groupby("_g", sort=True).agg(
+        **{
+            "Deck A": ("Deck A", "first"),
+            "Deck B": ("Deck B", "first"),
+            "W": ("W", "sum"),
+            "L": ("L", "sum"),
+            "T": ("T", "sum"),
+            "_nmax": ("N", "first"),
+            "_k": ("N", "size"),
+        }
+    )
+
+    # un solo WARNING riassuntivo; il dettaglio per coppia va a DEBUG
+    ties = df_flat[df_flat["_k"] > 1]
+    if not ties.empty:
+        a0, b0, k0, n0 = ties[["Deck A", "Deck B", "_k", "_nmax"]].iloc[0]
+        log.warning("[Tie N] %d coppie con più righe a N massimo — aggrego somme. Esempio: %s vs %s (%d righe, N=%d)",
+                    len(ties), a0, b0, k0, n0)
+        if log.isEnabledFor(logging.DEBUG):
+            for a, b, k, nmax in ties[["Deck A", "Deck B", "_k", "_nmax"]].itertuples(index=False):
+                log.debug("[Tie N] %s vs %s — %d righe con N massimo=%d — aggrego somme.", a, b, k, nmax)
+
+    df_flat["N"] = df_flat["W"] + df_flat["L"] + df_flat["T"]
+    Wv = df_flat["W"].to_numpy(dtype=float)
+    Nv = df_flat["N"].to_numpy(dtype=float)
+    wr = np.divide(100.0 * Wv, Nv, out=np.zeros_like(Wv), where=Nv > 0)
+    df_flat["Winrate"] = np.round(wr, 2)
+    df_flat = df_flat[["Deck A", "Deck B", "W", "L", "T", "N", "Winrate"]]
 
-    out_rows = []
-    for (a, b), grp in d.groupby(["Deck A", "Deck B"], sort=False):
-        if grp.empty:
-            continue
-        nmax = int(grp["N"].max())
-        top = grp[grp["N"] == nmax]
-        if len(top) == 1:
-            r = top.iloc[0]
-            out_rows.append({
-                "Deck A": a, "Deck B": b,
-                "W": int(r["W"]), "L": int(r["L"]), "T": int(r["T"]),
-                "N": int(r["N"]),
-                "Winrate": round((100.0 * float(r["W"]) / float(r["N"])) if int(r["N"])>0 else 0.0, 2)
-            })
-        else:
-            log.warning("[Tie N] %s vs %s — %d righe con N massimo=%d — aggrego somme.", a, b, len(top), nmax)
-            W = int(top["W"].sum())
-            L = int(top["L"].sum())
-            T = int(top["T"].sum())
-            N = int(W + L + T)
-            wr = round(100.0 * W / N, 2) if N > 0 else 0.0
-            out_rows.append({"Deck A": a, "Deck B": b, "W": W, "L": L, "T": T, "N": N, "Winrate": wr})
-
-    df_flat = pd.DataFrame(out_rows)
-    if df_flat.empty:
-        return df_flat
     # ordina per A e N desc
     df_flat = df_flat.sort_values(["Deck A", "N"], ascending=[True, False], kind="mergesort").reset_index(drop=True)
     # tipi
@@ -71,79 +96,112 @@ def maxN_flat(df_raw: pd.DataFrame) -> pd.DataFrame:
     df_flat["Winrate"] = df_flat["Winrate"].astype(float)
     return df_flat
 
+@lru_cache(maxsize=None)
 def _norm_key(s: str) -> str:
-    """Normalizza per lookup alias_index."""
-    return unicodedata.normalize("NFKC", str(s)).strip().casefold()
+    """Normalizza per lookup alias_index (NFKC è l'identità sulle stringhe ASCII)."""
+    s = str(s)
+    if s.isascii():
+        return s.strip().casefold()
+    return unicodedata.normalize("NFKC", s).strip().casefold()
 
 
 def _apply_alias_series(s: pd.Series, alias_index: Dict[str, str]) -> pd.Series:
     if not alias_index:
         return s.astype(str).str.strip()
-    return s.astype(str).map(lambda x: alias_index.get(_norm_key(x), str(x).strip()))
+    cat = pd.Categorical(s.astype(str))
+    new_cats = np.array([alias_index.get(_norm_key(c), c.strip()) for c in cat.categories], dtype=object)
+    return pd.Series(new_cats[cat.codes], index=s.index)
+
 
+def _sort_ab(df: pd.DataFrame) -> pd.DataFrame:
+    """Ordina per (Deck A, Deck B) lessicografico via codici interi (lexsort stabile)."""
+    n = len(df)
+    codes, _ = pd.factorize(
+        np.concatenate([df["Deck A"].to_numpy(dtype=object), df["Deck B"].to_numpy(dtype=object)]), sort=True
+    )
+    return df.iloc[np.lexsort((codes[n:], codes[:n]))].reset_index(drop=True)
 
-def _enforce_directional_symmetry(df: pd.DataFrame) -> pd.DataFrame:
+
+def _enforce_directional_symmetry(df: pd.DataFrame, *, sort: bool = True) -> pd.DataFrame:
     """
     Impone simmetria direzionale per ogni coppia non ordinata {A,B}.
     Regola: scegli la direzione con N_dir = W+L maggiore (tie-break su N=W+L+T, poi lessicografico),
     poi crea la riga speculare scambiando W<->L (T e N uguali).
+    sort=False salta l'ordinamento finale (il chiamante riordina comunque).
     """
     if df.empty:
         return df.copy()
 
     d = df.copy()
     for c in ("W", "L", "T"):
-        d[c] = pd.to_numeric(d[c], errors="coerce").fillna(0).astype("Int64")
+        d[c] = _counts_col(d[c], clip=False)
     d["N"] = (d["W"] + d["L"] + d["T"]).astype("Int64")
     d["N_dir"] = (d["W"] + d["L"]).astype("Int64")
 
-    # chiave non-ordinata per {A,B}
-    pair_key = np.where(
-        d["Deck A"] <= d["Deck B"],
-        d["Deck A"] + "||" + d["Deck B"],
-        d["Deck B"] + "||" + d["Deck A"],
+    # codici condivisi A∪B in ordine lessicografico → rank per il tie-break e
+    # chiave intera non-ordinata per {A,B}: min(ca,cb)*K + max(ca,cb)
+    n = len(d)
+    codes, uniques = pd.factorize(
+        np.concatenate([d["Deck A"].to_numpy(dtype=object), d["Deck B"].to_numpy(dtype=object)]), sort=True
     )
-    d["_pair"] = pair_key
-
-    rows = []
-    for key, g in d.groupby("_pair", sort=False):
-        # due possibili direzioni (A,B) e (B,A), ma talvolta ne arriva solo una
-        # scegliamo la riga con N_dir max, poi N, poi ordine lessicografico di (A,B)
-        g = g.copy()
-        g["_tie_sort"] = list(
-            zip(
-                -g["N_dir"].astype(int),          # max first
-                -g["N"].astype(int),              # poi N totale
-                g["Deck A"].astype(str),          # infine deterministico
-                g["Deck B"].astype(str),
-            )
-        )
-        chosen = g.sort_values("_tie_sort").iloc[0]
-
-        A = str(chosen["Deck A"])
-        B = str(chosen["Deck B"])
-        W = int(chosen["W"])
-        L = int(chosen["L"])
-        T = int(chosen["T"])
-        N = int(chosen["N"])
-
-        # riga A->B (scelta) + riga speculare B->A
-        rows.append({"Deck A": A, "Deck B": B, "W": W, "L": L, "T": T, "N": N})
-        rows.append({"Deck A": B, "Deck B": A, "W": L, "L": W, "T": T, "N": N})
-
-    out = pd.DataFrame.from_records(rows)
-
-    # Tipi finali coerenti + Winrate direzionale (T esclusi)
-    for c in ("W", "L", "T", "N"):
-        out[c] = out[c].astype("Int64")
-
-    denom = (out["W"] + out["L"]).astype("Int64")
-    wr = np.where(denom > 0, 100.0 * out["W"].astype(float) / denom.astype(float), np.nan)
-    out["Winrate"] = pd.Series(wr, index=out.index).round(2)
-
-    # Ordine colonne come da contratto e sorting per leggibilità
-    out = out[["Deck A", "Deck B", "W", "L", "T", "N", "Winrate"]]
-    out = out.sort_values(["Deck A", "Deck B"], kind="mergesort").reset_index(drop=True)
+    rank_a = codes[:n].astype(np.int64)
+    rank_b = codes[n:].astype(np.int64)
+    pair_codes = np.minimum(rank_a, rank_b) * len(uniques) + np.maximum(rank_a, rank_b)
+
+    # due possibili direzioni (A,B) e (B,A), ma talvolta ne arriva solo una
+    # scegliamo la riga con N_dir max, poi N, poi ordine lessicografico di (A,B):
+    # un solo lexsort su chiavi intere, poi la prima riga di ogni coppia
+    order = np.lexsort((
+        rank_b,
+        rank_a,
+        -d["N"].to_numpy(dtype=np.int64),       # poi N totale
+        -d["N_dir"].to_numpy(dtype=np.int64),   # max first
+        pair_codes,
+    ))
+    sorted_pairs = pair_codes[order]
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = sorted_pairs[1:] != sorted_pairs[:-1]
+    chosen = d.iloc[order[first]][["Deck A", "Deck B", "W", "L", "T", "N"]]
+
+    # riga A->B (scelta) + riga speculare B->A (scambio A<->B e W<->L), su array NumPy
+    A = chosen["Deck A"].to_numpy(dtype=object)
+    B = chosen["Deck B"].to_numpy(dtype=object)
+    W, L, T, N = (chosen[c].to_numpy(dtype=np.int64) for c in ("W", "L", "T", "N"))
+    W2, L2 = np.concatenate([W, L]), np.concatenate([L, W])
+
+    # Winrate direzionale (T esclusi)
+    denom = (W2 + L2).astype(float)
+    wr = np.divide(100.0 * W2, denom, out=np.full(denom.shape, np.nan), where=denom > 0)
+    out = pd.DataFrame({
+        "Deck A": np.concatenate([A, B]),
+        "Deck B": np.concatenate([B, A]),
+        "W": pd.array(W2, dtype="Int64"),
+        "L": pd.array(L2, dtype="Int64"),
+        "T": pd.array(np.concatenate([T, T]), dtype="Int64"),
+        "N": pd.array(np.concatenate([N, N]), dtype="Int64"),
+        "Winrate": np.round(wr, 2),
+    })
+
+    # Ordine colonne già da contratto; sorting per leggibilità
+    return _sort_ab(out) if sort else out
+
+
+def _sum_by_directed_pair(d: pd.DataFrame) -> pd.DataFrame:
+    """Somma W/L/T/N per (Deck A, Deck B) in ordine di prima apparizione.
+    Le chiavi passano da un Categorical con dizionario condiviso A∪B (groupby su codici
+    interi invece che su hash di stringhe); in uscita i nomi tornano object.
+    """
+    names = pd.unique(np.concatenate([d["Deck A"].to_numpy(dtype=object), d["Deck B"].to_numpy(dtype=object)]))
+    cats = pd.CategoricalDtype(names)
+    keys = {"Deck A": d["Deck A"].astype(cats), "Deck B": d["Deck B"].astype(cats)}
+    out = (
+        d[["W", "L", "T", "N"]]
+         .groupby([keys["Deck A"], keys["Deck B"]], sort=False, observed=True)
+         .sum()
+         .reset_index()
+    )
+    out["Deck A"] = out["Deck A"].astype(object)
+    out["Deck B"] = out["Deck B"].astype(object)
     return out
 
 
@@ -159,27 +217,22 @@ def apply_alias_and_aggregate(df_flat: pd.DataFrame, alias_index: Dict[str, str]
     if df_flat is None or df_flat.empty:
         return pd.DataFrame(columns=["Deck A", "Deck B", "W", "L", "T", "N", "Winrate"])
 
-    d = df_flat.copy()
-
     # Normalizza nomi e applica alias
-    d["Deck A"] = _apply_alias_series(d["Deck A"], alias_index)
-    d["Deck B"] = _apply_alias_series(d["Deck B"], alias_index)
+    A = _apply_alias_series(df_flat["Deck A"], alias_index)
+    B = _apply_alias_series(df_flat["Deck B"], alias_index)
 
     # Rimuovi mirror
-    d = d[d["Deck A"] != d["Deck B"]].copy()
-    if d.empty:
+    keep = (A != B).to_numpy()
+    if not keep.any():
         return pd.DataFrame(columns=["Deck A", "Deck B", "W", "L", "T", "N", "Winrate"])
 
-    # Tipi & N
-    for c in ("W", "L", "T"):
-        d[c] = pd.to_numeric(d[c], errors="coerce").fillna(0).astype("Int64")
-    d["N"] = (d["W"] + d["L"] + d["T"]).astype("Int64")
+    # Tipi & N (frame nuovo con le sole colonne necessarie)
+    W, L, T = (_counts_col(df_flat[c][keep], clip=False) for c in ("W", "L", "T"))
+    d = pd.DataFrame({"Deck A": A[keep], "Deck B": B[keep], "W": W, "L": L, "T": T,
+                      "N": (W + L + T).astype("Int64")})
 
     # Aggrega su (A,B) per consolidare eventuali duplicati direzionali
-    d = (
-        d.groupby(["Deck A", "Deck B"], as_index=False, sort=False)[["W", "L", "T", "N"]]
-         .sum()
-    )
+    d = _sum_by_directed_pair(d)
 
     # Impone simmetria direzionale (crea entrambe le direzioni coerenti)
     out = _enforce_directional_symmetry(d)
@@ -189,12 +242,25 @@ def apply_alias_and_aggregate(df_flat: pd.DataFrame, alias_index: Dict[str, str]
     # eventuali discrepanze si intercetteranno nel validatore
     return out
 
+def _is_directionally_symmetric(d: pd.DataFrame) -> bool:
+    """True se ogni (A,B) è unico e la riga (B,A) esiste con W/L scambiati e T uguale."""
+    key = pd.MultiIndex.from_arrays([d["Deck A"], d["Deck B"]])
+    if key.has_duplicates:
+        return False
+    pos = key.get_indexer(pd.MultiIndex.from_arrays([d["Deck B"], d["Deck A"]]))
+    if (pos < 0).any():
+        return False
+    W, L, T = (d[c].to_numpy(dtype=np.int64) for c in ("W", "L", "T"))
+    return bool((W == L[pos]).all() and (T == T[pos]).all())
+
+
 def build_score_table_filtered(
     df_flat_alias: pd.DataFrame,
     kept_axis: list[str],
     *,
     round_wr: int = 2,
-    legacy_winrate_alias: bool = True
+    legacy_winrate_alias: bool = True,
+    assume_symmetric: bool = False
 ) -> pd.DataFrame:
     """
     Costruisce la score table post-alias e post-filtro NaN.
@@ -207,6 +273,10 @@ def build_score_table_filtered(
     Output (contratto):
       - DataFrame con solo deck ∈ kept_axis, senza diagonale, entrambe le direzioni presenti,
         colonne: Deck A, Deck B, W, L, T, N, WR_dir (+ opzionale Winrate = WR_dir).
+
+    assume_symmetric=True salta riaggregazione e simmetria se l'input (post-filtro) è
+    già coerente: (A,B) unici, speculare (B,A) presente con W/L scambiati e T uguale.
+    Se l'invariante non regge si ricade sul percorso completo.
     """
     # Caso banale / asse vuoto
     cols = ["Deck A", "Deck B", "W", "L", "T", "N", "WR_dir"]
@@ -225,30 +295,23 @@ def build_score_table_filtered(
 
     kept_set = set(map(str, kept_axis))
 
-    # 1) Filtro rigido su asse kept
-    d = df_flat_alias.copy()
-    d = d[d["Deck A"].isin(kept_set) & d["Deck B"].isin(kept_set)].copy()
-    if d.empty:
+    # 1) Filtro rigido su asse kept + 2) via qualsiasi diagonale residua (per robustezza)
+    A, B = df_flat_alias["Deck A"], df_flat_alias["Deck B"]
+    keep = (A.isin(kept_set) & B.isin(kept_set) & (A != B)).to_numpy()
+    if not keep.any():
         return pd.DataFrame(columns=cols_with_legacy)
 
-    # 2) Rimuovi qualsiasi diagonale residua (per robustezza)
-    d = d[d["Deck A"] != d["Deck B"]].copy()
-    if d.empty:
-        return pd.DataFrame(columns=cols_with_legacy)
+    # 3) Tipi + N verità (frame nuovo con le sole colonne necessarie)
+    W, L, T = (_counts_col(df_flat_alias[c][keep]) for c in ("W", "L", "T"))
+    d = pd.DataFrame({"Deck A": A[keep], "Deck B": B[keep], "W": W, "L": L, "T": T,
+                      "N": (W + L + T).astype("Int64")})
 
-    # 3) Tipi + N verità
-    for c in ("W", "L", "T"):
-        d[c] = pd.to_numeric(d[c], errors="coerce").fillna(0).clip(lower=0).astype("Int64")
-    d["N"] = (d["W"] + d["L"] + d["T"]).astype("Int64")
-
-    # 4) Aggrega su (A,B) per idempotenza
-    d = (
-        d.groupby(["Deck A", "Deck B"], as_index=False, sort=False)[["W", "L", "T", "N"]]
-         .sum()
-    )
+    if not (assume_symmetric and _is_directionally_symmetric(d)):
+        # 4) Aggrega su (A,B) per idempotenza
+        d = _sum_by_directed_pair(d)
 
-    # 5) (Ri)impone simmetria direzionale coerente
-    d = _enforce_directional_symmetry(d)
+        # 5) (Ri)impone simmetria direzionale coerente
+        d = _enforce_directional_symmetry(d, sort=False)
 
     # 6) WR_dir = 100*W/(W+L); droppa denom==0 (non dovrebbero esserci su asse kept)
     denom = (d["W"] + d["L"]).astype("Int64")
@@ -257,7 +320,7 @@ def build_score_table_filtered(
     d = d[denom > 0].copy()
 
     # 7) Ordinamento deterministico + colonne contratto
-    out = d.sort_values(["Deck A", "Deck B"], kind="mergesort").reset_index(drop=True)
+    out = _sort_ab(d)
     out = out[["Deck A", "Deck B", "W", "L", "T", "N", "WR_dir"]]
     if legacy_winrate_alias:
         out["Winrate"] = out["WR_dir"]  # alias legacy per compatibilità
@@ -13,6 +13,26 @@ log = logging.getLogger("ptcgp")
 
 from core.normalize import apply_alias_series
 
+def _group_sum(codes: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """Somma per gruppo con la stessa somma compensata (Kahan) del groupby pandas.
+    Un passo vettoriale per posizione nel gruppo: i cicli sono max(size gruppo), non N righe.
+    """
+    order = np.argsort(codes, kind="stable")
+    c, v = codes[order], values[order]
+    start = np.searchsorted(c, np.arange(n_groups))
+    rank = np.arange(c.size) - start[c]
+    total = np.zeros(n_groups)
+    comp = np.zeros(n_groups)
+    for j in range(int(rank.max()) + 1 if c.size else 0):
+        sel = rank == j
+        g = c[sel]
+        y = v[sel] - comp[g]
+        t = total[g] + y
+        comp[g] = (t - total[g]) - y
+        total[g] = t
+    return total
+
+
 def topmeta_post_alias(df_top_meta: pd.DataFrame, alias_index: dict) -> pd.DataFrame:
     """
     Da top_meta (Deck + qualche colonna di share), costruisce:
@@ -67,9 +87,11 @@ def topmeta_post_alias(df_top_meta: pd.DataFrame, alias_index: dict) -> pd.DataF
     df["Deck"] = apply_alias_series(df["Deck_raw"], alias_index)
 
     # 6) Aggrega sul canonico, ordina, calcola Share_%
+    #    (codici ordinati come il groupby, somma per gruppo vettoriale)
+    codes, uniq = pd.factorize(df["Deck"].to_numpy(dtype=object), sort=True)
+    sums = _group_sum(codes, df["Share_frac"].to_numpy(dtype=float), len(uniq))
     out = (
-        df.groupby("Deck", as_index=False)["Share_frac"]
-          .sum()
+        pd.DataFrame({"Deck": uniq, "Share_frac": sums})
           .sort_values("Share_frac", ascending=False)
           .reset_index(drop=True)
     )
@@ -87,27 +109,33 @@ def build_matrices(df_flat_alias: pd.DataFrame, axis: List[str], *, mode: str =
     """
     if not axis:
         raise RuntimeError("Asse Top-meta vuoto")
-    df = df_flat_alias.copy()
-    df = df[df["Deck A"].isin(axis) & df["Deck B"].isin(axis)]
-
-    # pivot W/L/T
-    W = (df.pivot_table(index="Deck A", columns="Deck B", values="W", aggfunc="sum", fill_value=0)
-           .reindex(index=axis, columns=axis, fill_value=0))
-    L = (df.pivot_table(index="Deck A", columns="Deck B", values="L", aggfunc="sum", fill_value=0)
-           .reindex(index=axis, columns=axis, fill_value=0))
-    T = (df.pivot_table(index="Deck A", columns="Deck B", values="T", aggfunc="sum", fill_value=0)
-           .reindex(index=axis, columns=axis, fill_value=0))
-
-    # WR
-    Wv, Lv, Tv = W.to_numpy(float), L.to_numpy(float), T.to_numpy(float)
+    # codici sull'asse (−1 = fuori asse) → accumulo diretto nelle matrici N×N, niente pivot
+    idx = pd.Index(axis)
+    ia = idx.get_indexer(df_flat_alias["Deck A"])
+    ib = idx.get_indexer(df_flat_alias["Deck B"])
+    keep = (ia >= 0) & (ib >= 0)
+    ia, ib = ia[keep], ib[keep]
+    n = len(idx)
+    mats = []
+    for col in ("W", "L", "T"):
+        v = df_flat_alias[col].to_numpy()[keep]
+        m = np.zeros((n, n), dtype=np.int64 if np.issubdtype(v.dtype, np.integer) else float)
+        np.add.at(m, (ia, ib), v)
+        mats.append(m)
+    W, L, T = (pd.DataFrame(m, index=pd.Index(axis, name="Deck A"), columns=pd.Index(axis, name="Deck B"))
+               for m in mats)
+
+    # WR: un solo np.divide sugli array di conteggio (niente copie float di W/L/T)
+    Wv, Lv, Tv = mats
     if mode == "half":
         denom = Wv + Lv + Tv
         num = Wv + 0.5 * Tv
+        num *= 100.0
     else:
         denom = Wv + Lv
-        num = Wv
-    wr = np.full_like(denom, np.nan, dtype=float)
-    np.divide(100.0 * num, denom, out=wr, where=(denom > 0))
+        num = 100.0 * Wv
+    wr = np.full((n, n), np.nan, dtype=float)
+    np.divide(num, denom, out=wr, where=(denom > 0))
     if mirror is None:
         np.fill_diagonal(wr, np.nan)
     else:
@@ -118,12 +146,7 @@ def build_matrices(df_flat_alias: pd.DataFrame, axis: List[str], *, mode: str =
 
 
 def n_dir_from_WL(W: pd.DataFrame, L: pd.DataFrame) -> pd.DataFrame:
-    n_dir = (W.astype(int) + L.astype(int)).astype("Int64")
-    arr = n_dir.to_numpy(copy=True)
-    # NaN diagonale per contratto (come matrice WR)
-    # Manteniamo 0 nei conti ma la matrice contrattuale vuole NaN in diag
-    import numpy as np
-    arr = arr.astype(float)
+    # una somma intera + un cast float; NaN diagonale per contratto (come matrice WR)
+    arr = (W.to_numpy(dtype=np.int64) + L.to_numpy(dtype=np.int64)).astype(np.float64)
     np.fill_diagonal(arr, np.nan)
-    return pd.DataFrame(arr, index=n_dir.index, columns=n_dir.columns)
-
+    return pd.DataFrame(arr, index=W.index, columns=W.columns)
@@ -27,27 +27,27 @@ def filter_wr_nan_iterative(wr: pd.DataFrame, *, max_nan_ratio: float, min_nan_a
     allowed = math.ceil(base) if use_ceil else math.floor(base)
     allowed = max(int(min_nan_allowed), int(allowed))
 
-    def _offdiag_nan_counts(df: pd.DataFrame) -> pd.Series:
-        is_nan = df.isna()
-        return is_nan.sum(axis=1).sub(np.diag(is_nan.values)).astype("int64")
-
+    # maschera NaN calcolata una volta; i conteggi per riga si aggiornano solo per le colonne droppate
+    labels = np.asarray(axis, dtype=object)
+    mask = np.isnan(wr.to_numpy(dtype=float))
+    row_nan = (mask.sum(axis=1) - np.diag(mask)).astype(np.int64)
+    alive = np.ones(len(axis), dtype=bool)
     dropped: List[str] = []
-    cur = wr.copy()
     it = 0
     while True:
-        if cur.shape[0] <= 2:
-            break
-        counts = _offdiag_nan_counts(cur)
-        over = counts - allowed
-        over = over[over > 0]
-        if over.empty:
+        if int(alive.sum()) <= 2:
             break
+        over = np.where(alive, row_nan - allowed, 0)
         exceed = int(over.max())
-        to_drop = over[over == exceed].index.tolist()
+        if exceed <= 0:
+            break
+        hit = np.flatnonzero(over == exceed)
+        to_drop = labels[hit].tolist()
         log.info("[NaN-filter] iter %d: drop %d mazzi (excess=%d > allowed=%d). Esempio: %s", it+1, len(to_drop), exceed, allowed, to_drop[0])
-        cur = cur.drop(index=to_drop, columns=to_drop)
+        alive[hit] = False
+        row_nan -= mask[:, hit].sum(axis=1)
         dropped.extend(to_drop)
         it += 1
 
-    return cur, dropped
-
+    pos = np.flatnonzero(alive)
+    return wr.iloc[pos, pos], dropped
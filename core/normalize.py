@@ -14,20 +14,27 @@
 # ──────────────────────────────────────────────────────────────────────────────
 
 from __future__ import annotations
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Iterable, Tuple
 import json
 import logging
 import unicodedata
+import numpy as np
 import pandas as pd
 
 log = logging.getLogger("ptcgp")
 
 # Normalizza per confronti robusti (NFKC + trim + collapse spazi + casefold)
+# Memoizzata: i nomi deck si ripetono centinaia di volte tra righe/colonne.
+@lru_cache(maxsize=None)
 def normalize_label(s: str) -> str:
     if s is None:
         return ""
-    x = unicodedata.normalize("NFKC", str(s)).strip()
+    x = str(s)
+    if not x.isascii():  # NFKC è l'identità sull'ASCII
+        x = unicodedata.normalize("NFKC", x)
+    x = x.strip()
     x = " ".join(x.split())
     return x.casefold()
 
@@ -69,7 +76,10 @@ def build_alias_index(alias_map: Dict[str, list[str]]) -> Dict[str, str]:
 def apply_alias_series(series: pd.Series, alias_index: Dict[str, str]) -> pd.Series:
     if not alias_index:
         return series.astype(str).str.strip()
-    return series.astype(str).map(lambda x: alias_index.get(normalize_label(x), x)).astype(str)
+    # lookup una volta per categoria, poi take vettoriale sui codici
+    cat = pd.Categorical(series.astype(str))
+    new_cats = np.array([alias_index.get(normalize_label(c), c) for c in cat.categories], dtype=object)
+    return pd.Series(new_cats[cat.codes], index=series.index).astype(str)
 
 
 def alias_coverage(series: pd.Series, alias_index: Dict[str, str]) -> float:
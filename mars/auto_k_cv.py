@@ -2,37 +2,80 @@ from __future__ import annotations
 import numpy as np
 import pandas as pd
 from math import lgamma
+from scipy.special import gammaln
 from .config import MARSConfig
 
-def _split_counts(W: int, L: int, rho: float) -> tuple[int, int, int, int]:
+try:  # numba opzionale: JIT del kernel LL se disponibile, altrimenti NumPy vettoriale
+    from numba import njit
+except Exception:
+    njit = None
+
+def _split_counts(W: np.ndarray, L: np.ndarray, rho: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    Deterministic split: test ≈ rho*N with min 2 in test when N>=4, and keep >=1 in train if N>1.
-    Returns (Wtr, Ltr, Wte, Lte).
+    Deterministic split (vettoriale su tutte le celle): test ≈ rho*N with min 2 in test when N>=4,
+    and keep >=1 in train if N>1. Celle con N<=0 → tutto 0.
+    Returns (Wtr, Ltr, Wte, Lte) come array int64.
     """
-    W = int(round(float(W))); L = int(round(float(L)))
+    W = np.rint(np.asarray(W, dtype=float)).astype(np.int64)
+    L = np.rint(np.asarray(L, dtype=float)).astype(np.int64)
     N = W + L
-    if N <= 0:
-        return 0, 0, 0, 0
-    test_target = int(round(rho * N))
-    if N >= 4:
-        test_target = max(test_target, 2)
-    test = min(max(1, test_target), max(0, N - 1))
-    Wte = int(round(test * (W / N))) if N > 0 else 0
-    Wte = max(0, min(Wte, W))
-    Lte = test - Wte
-    Lte = max(0, min(Lte, L))
+    pos = N > 0
+    test_target = np.rint(rho * N).astype(np.int64)
+    test_target = np.where(N >= 4, np.maximum(test_target, 2), test_target)
+    test = np.minimum(np.maximum(1, test_target), np.maximum(0, N - 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Wte = np.where(pos, np.rint(test * (W / np.where(pos, N, 1))), 0).astype(np.int64)
+    Wte = np.clip(Wte, 0, W)
+    Lte = np.clip(test - Wte, 0, L)
     Wtr, Ltr = W - Wte, L - Lte
-    if (Wtr + Ltr) <= 0 and N > 1:
-        if Wte >= Lte and Wte > 0:
-            Wte -= 1; Wtr += 1
-        elif Lte > 0:
-            Lte -= 1; Ltr += 1
-    return Wtr, Ltr, Wte, Lte
-
-def _logB(x: float, y: float) -> float:
-    """log Beta via lgamma (stable)."""
-    x = float(x); y = float(y)
-    return lgamma(x) + lgamma(y) - lgamma(x + y)
+    # train vuoto con N>1: riporta una prova in train (prima dai W, altrimenti dai L)
+    fix = ((Wtr + Ltr) <= 0) & (N > 1)
+    fix_w = fix & (Wte >= Lte) & (Wte > 0)
+    fix_l = fix & ~fix_w & (Lte > 0)
+    Wte = Wte - fix_w; Wtr = Wtr + fix_w
+    Lte = Lte - fix_l; Ltr = Ltr + fix_l
+    zero = np.zeros_like(N)
+    return (np.where(pos, Wtr, zero), np.where(pos, Ltr, zero),
+            np.where(pos, Wte, zero), np.where(pos, Lte, zero))
+
+def _ll_cells_np(Wtr: np.ndarray, Ltr: np.ndarray, Wte: np.ndarray, Lte: np.ndarray,
+                 a0: float, b0: float) -> np.ndarray:
+    """LL predittiva Beta-Binomiale per cella (fallback NumPy senza numba)."""
+    alpha = a0 + Wtr
+    beta = b0 + Ltr
+    return (gammaln(Wte + alpha) + gammaln(Lte + beta) - gammaln(Wte + Lte + alpha + beta)
+            - (gammaln(alpha) + gammaln(beta) - gammaln(alpha + beta)))
+
+def _ll_total_np(Wtr: np.ndarray, Ltr: np.ndarray, Wte: np.ndarray, Lte: np.ndarray,
+                 a0: float, b0: float) -> float:
+    """Somma LL predittiva Beta-Binomiale sulle celle (fallback NumPy senza numba)."""
+    return float(_ll_cells_np(Wtr, Ltr, Wte, Lte, a0, b0).sum())
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _ll_cells(Wtr, Ltr, Wte, Lte, a0, b0):
+        """LL predittiva Beta-Binomiale per cella: logB(Wte+α, Lte+β) − logB(α, β)."""
+        out = np.empty(Wtr.size)
+        for i in range(Wtr.size):
+            alpha = a0 + Wtr[i]
+            beta = b0 + Ltr[i]
+            out[i] = (lgamma(Wte[i] + alpha) + lgamma(Lte[i] + beta) - lgamma(Wte[i] + Lte[i] + alpha + beta)
+                      - (lgamma(alpha) + lgamma(beta) - lgamma(alpha + beta)))
+        return out
+
+    @njit(cache=True, fastmath=True)
+    def _ll_total(Wtr, Ltr, Wte, Lte, a0, b0):
+        """Somma LL predittiva Beta-Binomiale sulle celle: logB(Wte+α, Lte+β) − logB(α, β)."""
+        total = 0.0
+        for i in range(Wtr.size):
+            alpha = a0 + Wtr[i]
+            beta = b0 + Ltr[i]
+            total += (lgamma(Wte[i] + alpha) + lgamma(Lte[i] + beta) - lgamma(Wte[i] + Lte[i] + alpha + beta)
+                      - (lgamma(alpha) + lgamma(beta) - lgamma(alpha + beta)))
+        return total
+else:
+    _ll_cells = _ll_cells_np
+    _ll_total = _ll_total_np
 
 def auto_k_cv(
     S_dir: pd.DataFrame,
@@ -76,31 +119,25 @@ def auto_k_cv(
     K_grid = np.clip(grid_raw, max(k_lo_user, cfg.K_MIN), k_hi_user)
     K_grid = np.unique(K_grid)
 
-    # precompute splits
-    splits = [_split_counts(int(w), int(l), cfg.RHO_TEST) for (w, l) in zip(W_vec, L_vec)]
-    idx_used = [i for i, (Wtr, Ltr, Wte, Lte) in enumerate(splits) if (Wte + Lte) > 0]
-    if not idx_used:
+    # precompute splits (vettoriale su tutte le celle)
+    Wtr_all, Ltr_all, Wte_all, Lte_all = _split_counts(W_vec.astype(np.int64), L_vec.astype(np.int64), cfg.RHO_TEST)
+    idx_used = np.flatnonzero((Wte_all + Lte_all) > 0)
+    if idx_used.size == 0:
         raise RuntimeError("AUTO_K-CV: after split, no trials remain in test.")
 
+    # split come array float contigui (solo celle con test>0) per il kernel LL
+    Wtr_u, Ltr_u, Wte_u, Lte_u = (a[idx_used].astype(float) for a in (Wtr_all, Ltr_all, Wte_all, Lte_all))
+
     MU = float(cfg.MU)
 
-    def ll_pred_total(K: float, idx_subset: list[int] | None = None) -> float:
+    def ll_pred_total(K: float) -> float:
         if not (K > 0.0 and 0.0 < MU < 1.0):
             return -np.inf
         a0 = MU * K
         b0 = (1.0 - MU) * K
         if a0 <= 0.0 or b0 <= 0.0:
             return -np.inf
-        total = 0.0
-        it = idx_used if idx_subset is None else idx_subset
-        for i in it:
-            Wtr, Ltr, Wte, Lte = splits[i]
-            if Wte + Lte <= 0:
-                continue
-            alpha = a0 + Wtr
-            beta  = b0 + Ltr
-            total += _logB(Wte + alpha, Lte + beta) - _logB(alpha, beta)
-        return float(total)
+        return float(_ll_total(Wtr_u, Ltr_u, Wte_u, Lte_u, a0, b0))
 
     # evaluate grid
     LL = np.array([ll_pred_total(K) for K in K_grid], dtype=float)
@@ -131,7 +168,7 @@ def auto_k_cv(
     K_base = float(np.clip(beta_auto, K_grid.min(), K_grid.max()))
     LL_star = float(LL[best_idx])
     LL_base = float(ll_pred_total(K_base))
-    N_test_tot = float(sum((splits[i][2] + splits[i][3]) for i in idx_used))
+    N_test_tot = float((Wte_u + Lte_u).sum())
     dLL_per100 = (100.0 * (LL_star - LL_base) / N_test_tot) if N_test_tot > 0 else 0.0
 
     # light bootstrap over cells, deterministic seed
@@ -141,17 +178,18 @@ def auto_k_cv(
         K_grid.min(), K_grid.max()
     ))
 
-    def argmax_smallest(vals: dict[float, float]) -> float:
-        items = sorted(vals.items(), key=lambda kv: (-kv[1], kv[0]))
-        return float(items[0][0])
-
-    K_boot = []
-    for _ in range(int(cfg.BOOT_N)):
-        idx_sample = rng.integers(low=0, high=len(idx_used), size=len(idx_used))
-        subset = [idx_used[j] for j in idx_sample]
-        vals = {float(K): ll_pred_total(float(K), idx_subset=subset) for K in local_grid}
-        K_boot.append(argmax_smallest(vals))
-    K_boot = np.array(K_boot, dtype=float)
+    # LL per cella sulla griglia locale (G×n), calcolata una volta sola; ogni replica è
+    # un vettore di conteggi multinomiali per cella (bincount dei draw) → LL = counts @ LL_cells.
+    # Stessi draw di rng.integers del resampling per indici: K_boot riproducibile a parità di SEED.
+    n_used = int(idx_used.size)
+    LL_cells = np.stack([_ll_cells(Wtr_u, Ltr_u, Wte_u, Lte_u, MU * float(K), (1.0 - MU) * float(K))
+                         for K in local_grid])
+    draws = rng.integers(low=0, high=n_used, size=(int(cfg.BOOT_N), n_used))
+    offsets = np.arange(draws.shape[0])[:, None] * n_used
+    counts = np.bincount((draws + offsets).ravel(), minlength=draws.size).reshape(draws.shape)
+    LL_boot = counts @ LL_cells.T
+    # argmax con tie → K più piccolo (local_grid è ordinata crescente)
+    K_boot = local_grid[np.argmax(LL_boot, axis=1)] if LL_boot.size else np.array([], dtype=float)
 
     # boundary / stability rules
     at_boundary = (abs(K_star - K_grid.min()) <= 1e-12) or (abs(K_star - K_grid.max()) <= 1e-12)
@@ -1,19 +1,113 @@
 from __future__ import annotations
 import math
+from math import fabs
 import numpy as np
 import pandas as pd
+from scipy.optimize import minimize
 from .config import MARSConfig
+from .core import _Arrays
 
-def _s_of(N: float, K: float) -> float:
-    """Confidenza direzionale s = N/(N+K)."""
-    return (float(N) / (float(N) + float(K))) if N > 0 else 0.0
+try:  # numba opzionale: JIT dell'iterazione MM se disponibile, altrimenti Python puro
+    from numba import njit, prange
+except Exception:
+    njit = None
+    prange = range
+
+# sopra questa soglia di righe lo sweep MM usa la variante parallela (prange sui deck);
+# per assi tipici (decine di deck) l'overhead dei thread supera il guadagno
+_BT_PAR_MIN_N = 256
 
 def _hhi(vals: np.ndarray) -> float:
+    """Indice di Herfindahl Σ(v/tot)² = (v·v)/tot², senza l'array delle quote."""
     tot = float(vals.sum())
     if not np.isfinite(tot) or tot <= 0:
         return float("nan")
-    p = vals / tot
-    return float(np.sum(p * p))
+    return float(np.dot(vals, vals) / (tot * tot))
+
+def _bt_mm(nbr_idx, nbr_win, nbr_loss, row_ptr, lam, max_iter, tol):
+    """Iterazione BT con ridge λ su adiacenza CSR, nella forma accelerata di Newman:
+    π_i ← (Σ_j w_ij·π_j/(π_i+π_j) + λ) / (Σ_j w_ji/(π_i+π_j) + λ).
+    Stesso punto fisso dell'MM classico (s_i+λ)/(Σ_j n_ij/(π_i+π_j)+λ), ma molte meno iterazioni.
+    Costanti e valori per-riga legati a variabili locali (vale anche senza numba).
+    Update di Jacobi (legge pi, scrive new_pi): le righe sono indipendenti, quindi il loop
+    sui deck è un prange; max_rel è una riduzione max.
+    """
+    n = len(row_ptr) - 1
+    pi = np.ones(n)
+    new_pi = np.empty(n)
+    for _ in range(max_iter):
+        max_rel = 0.0
+        for i in prange(n):
+            num_i = 0.0
+            den_i = 0.0
+            pi_i = pi[i]
+            for k in range(row_ptr[i], row_ptr[i + 1]):
+                pi_j = pi[nbr_idx[k]]
+                inv = 1.0 / (pi_i + pi_j + 1e-12)
+                num_i += nbr_win[k] * pi_j * inv
+                den_i += nbr_loss[k] * inv
+            upd = (num_i + lam) / (den_i + lam + 1e-12)
+            max_rel = max(max_rel, fabs(upd - pi_i) / (pi_i + 1e-9))
+            new_pi[i] = 1e-8 if 1e-8 > upd else upd
+        pi, new_pi = new_pi, pi
+        if max_rel < tol:
+            break
+    return pi
+
+if njit is not None:
+    _bt_mm_par = njit(cache=True, parallel=True)(_bt_mm)
+    _bt_mm_seq = njit(cache=True)(_bt_mm)
+
+    def _bt_mm(nbr_idx, nbr_win, nbr_loss, row_ptr, lam, max_iter, tol):
+        kernel = _bt_mm_par if len(row_ptr) - 1 >= _BT_PAR_MIN_N else _bt_mm_seq
+        return kernel(nbr_idx, nbr_win, nbr_loss, row_ptr, lam, max_iter, tol)
+else:
+    _bt_mm_py = _bt_mm
+
+    def _bt_mm(nbr_idx, nbr_win, nbr_loss, row_ptr, lam, max_iter, tol):
+        # senza numba: input in liste Python (l'indicizzazione scalare è molto più rapida che su ndarray)
+        return _bt_mm_py(nbr_idx.tolist(), nbr_win.tolist(), nbr_loss.tolist(), row_ptr.tolist(),
+                         lam, max_iter, tol)
+
+def _bt_csr(ia: np.ndarray, ja: np.ndarray, w_ij: np.ndarray, w_ji: np.ndarray, n: int):
+    """Adiacenza CSR non orientata degli archi (ia[k], ja[k]) per il kernel MM.
+    Ogni arco compare in entrambe le righe; dentro una riga i vicini restano nell'ordine
+    degli archi. Ritorna (row_ptr, nbr_idx, nbr_win, nbr_loss) con, per la voce i→j,
+    nbr_win = vittorie pesate di i su j e nbr_loss = quelle di j su i.
+    """
+    rows = np.column_stack([ia, ja]).ravel()
+    cols = np.column_stack([ja, ia]).ravel()
+    wins = np.column_stack([w_ij, w_ji]).ravel()
+    losses = np.column_stack([w_ji, w_ij]).ravel()
+    order = np.argsort(rows, kind="stable")
+    row_ptr = np.searchsorted(rows[order], np.arange(n + 1)).astype(np.int64)
+    return (row_ptr, np.ascontiguousarray(cols[order], dtype=np.int64),
+            np.ascontiguousarray(wins[order]), np.ascontiguousarray(losses[order]))
+
+def _bt_lbfgs(ia: np.ndarray, ja: np.ndarray, w_ij: np.ndarray, w_ji: np.ndarray, n: int,
+              lam: float, max_iter: int, tol: float) -> np.ndarray | None:
+    """Stesso MAP del loop MM (ridge λ ≡ prior Gamma(λ+1, λ) su π) risolto con L-BFGS-B su s = log π:
+      max_s Σ_k [w_ij·s_i + w_ji·s_j − (w_ij+w_ji)·log(π_i+π_j)] + λ·Σ_i (s_i − π_i),
+    concava in s; bound s ≥ log 1e-8 come il floor del MM. Ritorna π, o None se non converge.
+    """
+    w_tot = w_ij + w_ji
+    wins = np.bincount(ia, weights=w_ij, minlength=n) + np.bincount(ja, weights=w_ji, minlength=n)
+
+    def nll(s: np.ndarray) -> tuple[float, np.ndarray]:
+        p = np.exp(s)
+        den = p[ia] + p[ja]
+        r = w_tot / den
+        f = -(wins @ s - w_tot @ np.log(den) + lam * (s.sum() - p.sum()))
+        grad = -(wins - np.bincount(ia, weights=r * p[ia], minlength=n)
+                 - np.bincount(ja, weights=r * p[ja], minlength=n) + lam * (1.0 - p))
+        return float(f), grad
+
+    res = minimize(nll, np.zeros(n), jac=True, method="L-BFGS-B",
+                   bounds=[(math.log(1e-8), None)] * n,
+                   options={"maxiter": int(max_iter), "ftol": tol * 1e-6, "gtol": tol})
+    if not res.success or not np.all(np.isfinite(res.x)):
+        return None
+    return np.exp(res.x)
 
 def bt_soft(
     axis: list[str],
@@ -21,13 +115,16 @@ def bt_soft(
     p_hat: pd.DataFrame,
     K_used: float,
     cfg: MARSConfig,
+    *,
+    arrays: _Arrays | None = None,
 ) -> dict:
     """
     Bradley–Terry robusto:
       - filtro adattivo su confidenza media s̄ ≥ s_min (s_min da N_min_target, K_used)
       - n_base armonica se entrambe le direzioni >0, altrimenti media osservata
       - soft-weight n_eff = n_base * s̄^γ con γ auto-continuo se cfg.BT_SOFT_POWER is None
-      - stima MM con ridge (λ), normalizzazione media geometrica, mappa in [0,1] con sigmoide.
+      - stima MM con ridge (λ) (o L-BFGS-B con cfg.BT_SOLVER="lbfgs"), normalizzazione media
+        geometrica, mappa in [0,1] con sigmoide.
 
     Returns
     -------
@@ -42,47 +139,43 @@ def bt_soft(
     N_MIN = int(cfg.N_MIN_BT_TARGET)
     s_min = float(N_MIN) / (float(N_MIN) + float(K_used))
 
-    info_kept: list[tuple[str,str,float,float,float,float,float]] = []
-    edges_kept = edges_drop = 0
-    sbar_list: list[float] = []
-
-    for i, ai in enumerate(axis):
-        for j in range(i + 1, len(axis)):
-            aj = axis[j]
-            Nij = float(n_dir.loc[ai, aj])
-            Nji = float(n_dir.loc[aj, ai])
-            if (Nij <= 0.0) and (Nji <= 0.0):
-                continue
-
-            s_ij = _s_of(Nij, K_used)
-            s_ji = _s_of(Nji, K_used)
-            s_vals = [v for v in (s_ij, s_ji) if v > 0]
-            s_bar = (sum(s_vals) / len(s_vals)) if s_vals else 0.0
-            if s_bar < s_min:
-                edges_drop += 1
-                continue
-
-            p1 = p_hat.loc[ai, aj]
-            p2 = p_hat.loc[aj, ai]
-            if pd.notna(p1) and pd.notna(p2):
-                p_bar = 0.5 * (float(p1) + (1.0 - float(p2)))
-            elif pd.notna(p1):
-                p_bar = float(p1)
-            elif pd.notna(p2):
-                p_bar = 1.0 - float(p2)
-            else:
-                edges_drop += 1
-                continue
-
-            if cfg.BT_USE_HARMONIC_N and (Nij > 0.0) and (Nji > 0.0):
-                n_base = (2.0 * Nij * Nji) / (Nij + Nji)
-            else:
-                obs = [x for x in (Nij, Nji) if x > 0.0]
-                n_base = float(np.mean(obs)) if obs else 0.0
-
-            sbar_list.append(s_bar)
-            info_kept.append((ai, aj, Nij, Nji, n_base, s_bar, p_bar))
-            edges_kept += 1
+    # tutte le coppie i<j del triangolo superiore in un colpo solo (stesso ordine del doppio loop)
+    n = len(axis)
+    if arrays is not None and arrays.P is not None:
+        N_np, P_np = arrays.N, arrays.P
+    else:
+        N_np = n_dir.reindex(index=axis, columns=axis).to_numpy(dtype=float)
+        P_np = p_hat.reindex(index=axis, columns=axis).to_numpy(dtype=float)
+    iu, ju = np.triu_indices(n, k=1)
+    Nij_all = N_np[iu, ju]
+    Nji_all = N_np[ju, iu]
+    present = ~((Nij_all <= 0.0) & (Nji_all <= 0.0))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s_ij = np.where(Nij_all > 0, Nij_all / (Nij_all + float(K_used)), 0.0)
+        s_ji = np.where(Nji_all > 0, Nji_all / (Nji_all + float(K_used)), 0.0)
+    pos_ij, pos_ji = s_ij > 0, s_ji > 0
+    s_bar_all = np.where(pos_ij & pos_ji, (s_ij + s_ji) / 2.0, np.where(pos_ij, s_ij, np.where(pos_ji, s_ji, 0.0)))
+    ok_s = present & ~(s_bar_all < s_min)
+
+    p1, p2 = P_np[iu, ju], P_np[ju, iu]
+    has1, has2 = ~np.isnan(p1), ~np.isnan(p2)
+    p_bar_all = np.where(has1 & has2, 0.5 * (p1 + (1.0 - p2)), np.where(has1, p1, 1.0 - p2))
+    keep = ok_s & (has1 | has2)
+    edges_drop = int((present & ~ok_s).sum() + (ok_s & ~(has1 | has2)).sum())
+    edges_kept = int(keep.sum())
+
+    Nij, Nji = Nij_all[keep], Nji_all[keep]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n_obs = np.where(Nij > 0.0, Nij, 0.0) + np.where(Nji > 0.0, Nji, 0.0)
+        k_obs = (Nij > 0.0).astype(float) + (Nji > 0.0).astype(float)
+        n_base = np.where(k_obs > 0, n_obs / np.maximum(k_obs, 1.0), 0.0)
+        if cfg.BT_USE_HARMONIC_N:
+            both = (Nij > 0.0) & (Nji > 0.0)
+            n_base = np.where(both, (2.0 * Nij * Nji) / (Nij + Nji), n_base)
+    ia_k, ja_k = iu[keep], ju[keep]
+    sbar_kept = s_bar_all[keep]
+    pbar_kept = p_bar_all[keep]
 
     if edges_kept == 0:
         # fallback
@@ -92,24 +185,17 @@ def bt_soft(
                 "pairs": []}
 
     # 2) Diagnostica & auto soft-power
-    sbar_kept = np.asarray(sbar_list, dtype=float)
     near_mask = (sbar_kept >= s_min) & (sbar_kept < s_min + float(cfg.BT_NEAR_BAND))
     near_share = float(near_mask.mean())
     sbar_med = float(np.nanmedian(sbar_kept)) if sbar_kept.size else float("nan")
 
-    lev_base = []
-    for (ai, aj, Nij, Nji, n_base, s_bar, p_bar) in info_kept:
-        lev_base.append(float(max(n_base, 1e-12) * abs(float(p_bar) - 0.5)))
-    lev_base = np.asarray(lev_base, dtype=float)
+    lev_base = np.maximum(n_base, 1e-12) * np.abs(pbar_kept - 0.5)
     hhi_lev = _hhi(lev_base)
 
-    deck_counts = {d: 0 for d in axis}
-    for (ai, aj, *_rest) in info_kept:
-        deck_counts[ai] += 1
-        deck_counts[aj] += 1
-    opp_counts = pd.Series(deck_counts)
-    min_opp = int(opp_counts.min()) if len(opp_counts) else 0
-    med_opp = float(opp_counts.median()) if len(opp_counts) else float("nan")
+    # avversari per deck sugli archi tenuti (ogni arco conta per entrambi gli estremi)
+    opp_counts = np.bincount(np.concatenate([ia_k, ja_k]), minlength=n)
+    min_opp = int(opp_counts.min()) if n else 0
+    med_opp = float(np.median(opp_counts)) if n else float("nan")
 
     # Soft-power γ
     if cfg.BT_SOFT_POWER is None:
@@ -125,53 +211,40 @@ def bt_soft(
         soft_power = float(cfg.BT_SOFT_POWER)
         pow_mode = "set"
 
-    # 3) Costruzione coppie e pesi soft
-    pairs_bt: list[tuple[str, str, float, float, float]] = []
-    for (ai, aj, Nij, Nji, n_base, s_bar, p_bar) in info_kept:
-        p_bar = float(np.clip(float(p_bar), 1e-9, 1.0 - 1e-9))
-        n_eff = float(max(float(n_base) * float(s_bar ** float(soft_power)), 1e-9))
-        w_ij = float(p_bar * n_eff)
-        w_ji = float((1.0 - p_bar) * n_eff)
-        # sanity
-        if abs((w_ij + w_ji) - n_eff) > 1e-6:
-            raise AssertionError(f"w sum != n_eff for {ai} vs {aj}")
-        if not (0.0 < w_ij < n_eff and 0.0 < w_ji < n_eff):
-            raise AssertionError(f"w out of range for {ai} vs {aj}")
-        pairs_bt.append((ai, aj, n_eff, w_ij, w_ji))
-
-    # 4) Stima BT (MM con ridge)
-    idx_map = {d: i for i, d in enumerate(axis)}
-    wins_out = [0.0] * len(axis)
-    opp_list: list[list[tuple[int, float]]] = [[] for _ in axis]
-    for ai, aj, n_eff, w_ij, w_ji in pairs_bt:
-        i = idx_map[ai]; j = idx_map[aj]
-        wins_out[i] += w_ij
-        wins_out[j] += w_ji
-        opp_list[i].append((j, n_eff))
-        opp_list[j].append((i, n_eff))
-
-    pi = np.ones(len(axis), dtype=float)
-    for _ in range(int(cfg.MAX_BT_ITER)):
-        max_rel = 0.0
-        new_pi = pi.copy()
-        for i in range(len(axis)):
-            s_i = wins_out[i]
-            denom_i = 0.0
-            pi_i = pi[i]
-            for (j, n_eff) in opp_list[i]:
-                denom_i += n_eff / (pi_i + pi[j] + 1e-12)
-            upd = (s_i + float(cfg.LAMBDA_RIDGE)) / (denom_i + float(cfg.LAMBDA_RIDGE) + 1e-12)
-            max_rel = max(max_rel, abs(upd - pi_i) / (pi_i + 1e-9))
-            new_pi[i] = max(upd, 1e-8)
-        pi = new_pi
-        if max_rel < float(cfg.BT_TOL):
-            break
+    # 3) Costruzione coppie e pesi soft (vettoriale, un solo controllo di coerenza a valle)
+    p_clip = np.clip(pbar_kept, 1e-9, 1.0 - 1e-9)
+    n_eff = np.maximum(n_base * sbar_kept ** float(soft_power), 1e-9)
+    w_ij = p_clip * n_eff
+    w_ji = (1.0 - p_clip) * n_eff
+    bad_sum = np.abs((w_ij + w_ji) - n_eff) > 1e-6
+    bad_range = ~((0.0 < w_ij) & (w_ij < n_eff) & (0.0 < w_ji) & (w_ji < n_eff))
+    if (bad_sum | bad_range).any():
+        k = int(np.argmax(bad_sum | bad_range))
+        what = "w sum != n_eff" if bad_sum[k] else "w out of range"
+        raise AssertionError(f"{what} for {axis[ia_k[k]]} vs {axis[ja_k[k]]}")
+    pairs_bt: list[tuple[str, str, float, float, float]] = list(zip(
+        [axis[i] for i in ia_k], [axis[j] for j in ja_k], n_eff.tolist(), w_ij.tolist(), w_ji.tolist()
+    ))
+
+    # 4) Stima BT: MM con ridge (update di Newman) su adiacenza CSR, oppure L-BFGS-B
+    #    sullo stesso obiettivo se richiesto (MM come fallback se non converge)
+    lam, max_iter, tol = float(cfg.LAMBDA_RIDGE), int(cfg.MAX_BT_ITER), float(cfg.BT_TOL)
+    pi = None
+    solver = "mm"
+    if cfg.BT_SOLVER == "lbfgs":
+        pi = _bt_lbfgs(ia_k, ja_k, w_ij, w_ji, n, lam, max_iter, tol)
+        solver = "lbfgs" if pi is not None else "mm (fallback)"
+    if pi is None:
+        row_ptr, nbr_idx, nbr_win, nbr_loss = _bt_csr(ia_k, ja_k, w_ij, w_ji, n)
+        pi = _bt_mm(nbr_idx, nbr_win, nbr_loss, row_ptr, lam, max_iter, tol)
 
     # Scala & map a [0,1]
-    gmean = math.exp(np.log(pi).mean())
+    gmean = math.exp(float(np.mean(np.log(pi))))
     pi = pi / (gmean + 1e-12)
     theta = np.log(pi)
-    t_std = np.std(theta) if np.std(theta) > 0 else 1.0
+    t_std = float(np.std(theta))
+    if not t_std > 0:
+        t_std = 1.0
     bt_prob = 1.0 / (1.0 + np.exp(-theta / t_std))
     bt_score = pd.Series(bt_prob, index=axis)
 
@@ -186,5 +259,6 @@ def bt_soft(
         "BT_SOFT_POWER": soft_power,
         "BT_SOFT_POWER_mode": pow_mode,
         "s_min": s_min,
+        "solver": solver,
     }
     return {"bt_pct": bt_score * 100.0, "diag": diag, "pairs": pairs_bt}
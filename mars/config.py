@@ -51,6 +51,7 @@ class MARSConfig:
     LAMBDA_RIDGE: float = 1.5
     MAX_BT_ITER: int = 500
     BT_TOL: float = 1e-6
+    BT_SOLVER: str = "mm"                 # {'mm','lbfgs'}; lbfgs ricade su MM se non converge
 
     # --- Misc
     EPS: float = 1e-12
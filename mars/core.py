@@ -0,0 +1,23 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+@dataclass(frozen=True)
+class _Arrays:
+    """
+    Viste NumPy allineate all'asse, calcolate una volta in run_mars e passate agli stadi
+    (posterior/MAS/BT/coverage) per evitare reindex + to_numpy ripetuti sulle stesse matrici.
+
+    S, F : W e L direzionali (float, NaN dove la cella non ha righe)
+    N    : W+L direzionale (float, 0 dove non osservato)
+    OBS  : maschera di osservazione N>0 off-diagonale (bool, sola lettura)
+    P, V : p̂ e Var[p̂] (diag NaN), disponibili dopo posterior_dir
+    """
+    axis: list[str]
+    S: np.ndarray
+    F: np.ndarray
+    N: np.ndarray
+    OBS: Optional[np.ndarray] = None
+    P: Optional[np.ndarray] = None
+    V: Optional[np.ndarray] = None
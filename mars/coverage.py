@@ -1,8 +1,9 @@
 from __future__ import annotations
 import numpy as np
 import pandas as pd
+from .core import _Arrays
 
-def coverage_tables(n_dir: pd.DataFrame, axis: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+def coverage_tables(n_dir: pd.DataFrame, axis: list[str], *, arrays: _Arrays | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Costruisce:
       - coverage_df: per ogni deck, copertura osservata (Opp_used, Missing, Coverage_%, N_eff)
@@ -14,6 +15,8 @@ def coverage_tables(n_dir: pd.DataFrame, axis: list[str]) -> tuple[pd.DataFrame,
         Matrice W+L direzionale sull'asse finale (off-diag osservate se >0).
     axis : list[str]
         Ordine dei deck (righe/colonne).
+    arrays : _Arrays, optional
+        Se fornito, la maschera di osservazione è arrays.OBS (o deriva da arrays.N già allineato).
 
     Ritorna
     -------
@@ -22,40 +25,45 @@ def coverage_tables(n_dir: pd.DataFrame, axis: list[str]) -> tuple[pd.DataFrame,
     missing_pairs_long : pd.DataFrame
         Colonne: Deck, Missing_opponent (ordinate alfabeticamente per deck/opponent)
     """
-    N = n_dir.reindex(index=axis, columns=axis)
-    OBS = (N.fillna(0.0) > 0.0)
-    np.fill_diagonal(OBS.values, False)
+    if arrays is not None:
+        if arrays.OBS is not None:
+            OBS = arrays.OBS
+        else:
+            OBS = arrays.N > 0.0
+            np.fill_diagonal(OBS, False)
+        N_eff = n_dir.sum(axis=1, skipna=True).reindex(axis)
+    else:
+        N = n_dir.reindex(index=axis, columns=axis)
+        OBS = (N.fillna(0.0) > 0.0).to_numpy(dtype=bool)
+        np.fill_diagonal(OBS, False)
+        N_eff = N.sum(axis=1, skipna=True)
 
     Opp_used = OBS.sum(axis=1)
     Opp_total = len(axis) - 1
     Coverage = (Opp_used / max(Opp_total, 1)) * 100.0
-    N_eff = N.sum(axis=1, skipna=True)
+
+    # coppie mancanti (off-diag con W+L<=0 o NaN) in un solo np.where, ordine riga-major su axis
+    MISS = ~OBS
+    np.fill_diagonal(MISS, False)
+    rr, cc = np.where(MISS)
+    axis_arr = np.asarray(axis, dtype=object)
 
     # missing sample (max 5) per deck, preservando l’ordine di axis
-    miss_samples = []
-    for a in axis:
-        row = N.loc[a]
-        miss = [b for b in axis if (a != b and (row.get(b, 0.0) <= 0.0 or pd.isna(row.get(b, np.nan))))]
-        miss_samples.append(", ".join(miss[:5]))
+    bounds = np.searchsorted(rr, np.arange(len(axis) + 1))
+    miss_samples = [", ".join(axis_arr[cc[lo:min(lo + 5, hi)]]) for lo, hi in zip(bounds[:-1], bounds[1:])]
 
     coverage_df = pd.DataFrame({
         "Deck": axis,
-        "Opp_used": Opp_used.values,
+        "Opp_used": Opp_used,
         "Opp_total": int(Opp_total),
-        "Missing": (int(Opp_total) - Opp_used.values),
-        "Coverage_%": Coverage.values,
+        "Missing": (int(Opp_total) - Opp_used),
+        "Coverage_%": Coverage,
         "N_eff": N_eff.reindex(axis).values,
         "Missing_sample (max 5)": miss_samples,
     }).sort_values(["Missing", "Opp_used", "Deck"], ascending=[False, True, True]).reset_index(drop=True)
 
     # long list delle coppie mancanti (A→B con W+L<=0)
-    pairs = []
-    for a in axis:
-        row = N.loc[a]
-        for b in axis:
-            if a != b and (row.get(b, 0.0) <= 0.0 or pd.isna(row.get(b, np.nan))):
-                pairs.append((a, b))
-    missing_pairs_long = pd.DataFrame(pairs, columns=["Deck", "Missing_opponent"])\
+    missing_pairs_long = pd.DataFrame({"Deck": axis_arr[rr], "Missing_opponent": axis_arr[cc]})\
                           .sort_values(["Deck", "Missing_opponent"]).reset_index(drop=True)
 
     return coverage_df, missing_pairs_long
@@ -2,6 +2,7 @@ from __future__ import annotations
 import numpy as np
 import pandas as pd
 from .config import MARSConfig
+from .core import _Arrays
 
 def mas_se_lb(
     p_hat: pd.DataFrame,
@@ -9,6 +10,8 @@ def mas_se_lb(
     p_weights: pd.Series,
     n_dir: pd.DataFrame,
     cfg: MARSConfig,
+    *,
+    arrays: _Arrays | None = None,
 ) -> pd.DataFrame:
     """
     MAS/SE/LB con rinormalizzazione per riga sui soli avversari osservati (n_dir>0).
@@ -23,6 +26,9 @@ def mas_se_lb(
         Volumi direzionali W+L; OBS = (n_dir>0) off-diag.
     cfg : MARSConfig
         Usa Z_PENALTY.
+    arrays : _Arrays, optional
+        Se fornito (con P/V), usa arrays.N/P/V già allineati invece di reindex, e arrays.OBS
+        come maschera di osservazione se presente.
 
     Returns
     -------
@@ -30,38 +36,46 @@ def mas_se_lb(
         Colonne: MAS_%, SE_%, LB_% (percentuali 0–100), indicizzate per Deck.
     """
     axis = list(p_hat.index)
-    # Maschera di osservazione (off-diag)
-    OBS = (n_dir.fillna(0.0) > 0.0)
-    np.fill_diagonal(OBS.values, False)
+    # Tutto su array NumPy allineati ad axis (niente where/div/pow su DataFrame)
+    if arrays is not None and arrays.P is not None and arrays.V is not None:
+        N_np, P_np, V_np = arrays.N, arrays.P, arrays.V
+    else:
+        N_np = n_dir.reindex(index=axis, columns=axis).to_numpy(dtype=float)
+        P_np = p_hat.reindex(index=axis, columns=axis).to_numpy(dtype=float)
+        V_np = var_hat.reindex(index=axis, columns=axis).to_numpy(dtype=float)
 
-    # Base weights replicati per riga
-    W_base = pd.DataFrame(
-        np.broadcast_to(p_weights.reindex(axis).values, (len(axis), len(axis))),
-        index=axis, columns=axis
-    )
-    # Zeri dove non osservato
-    W_masked = W_base.where(OBS, other=0.0)
+    # Maschera di osservazione (off-diag), condivisa da run_mars se disponibile
+    if arrays is not None and arrays.OBS is not None:
+        OBS = arrays.OBS
+    else:
+        OBS = N_np > 0.0
+        np.fill_diagonal(OBS, False)
+
+    # Base weights su colonne, zeri dove non osservato
+    w = p_weights.reindex(axis).to_numpy(dtype=float)
+    W_masked = np.where(OBS, w[None, :], 0.0)
 
     # Rinormalizzazione riga sulle sole colonne osservate
-    row_sum = W_masked.sum(axis=1)
-    W_norm = W_masked.div(row_sum.replace(0.0, np.nan), axis=0)
+    row_sum = np.nansum(W_masked, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        W_norm = W_masked / np.where(row_sum == 0.0, np.nan, row_sum)[:, None]
 
-    rows_with_obs = OBS.sum(axis=1) > 0
+    rows_with_obs = OBS.any(axis=1)
     rows_need_uniform = rows_with_obs & (~np.isfinite(row_sum) | (row_sum <= 0.0))
     if rows_need_uniform.any():
-        unif = OBS.loc[rows_need_uniform].astype(float)
-        W_norm.loc[rows_need_uniform] = unif.div(unif.sum(axis=1), axis=0)
+        unif = OBS[rows_need_uniform].astype(float)
+        W_norm[rows_need_uniform] = unif / unif.sum(axis=1)[:, None]
 
-    # Nessuna osservazione: tutta la riga = NaN
-    no_obs_rows = (~rows_with_obs)
-    if no_obs_rows.any():
-        W_norm.loc[no_obs_rows] = np.nan
+    # Nessuna osservazione: tutta la riga = NaN (le somme skipna danno 0 come prima)
+    W_norm[~rows_with_obs] = np.nan
 
-    # MAS e var(MAS) vettoriali
-    MAS = (W_norm * p_hat).sum(axis=1)
-    VAR_MAS = (W_norm.pow(2) * var_hat).sum(axis=1)
+    # MAS e var(MAS) in riduzioni einsum (niente temporanei N×N per i prodotti);
+    # NaN → 0 equivale alle somme skipna: il termine con un fattore NaN non contribuisce
+    Wz = np.nan_to_num(W_norm, nan=0.0)
+    MAS = np.einsum("ij,ij->i", Wz, np.nan_to_num(P_np, nan=0.0))
+    VAR_MAS = np.einsum("ij,ij,ij->i", Wz, Wz, np.nan_to_num(V_np, nan=0.0))
 
-    SE = VAR_MAS.clip(lower=0.0).pow(0.5)
+    SE = np.sqrt(np.maximum(VAR_MAS, 0.0))
     LB = MAS - cfg.Z_PENALTY * SE
 
     out = pd.DataFrame({
@@ -1,10 +1,21 @@
 from __future__ import annotations
+import math
 import numpy as np
 import pandas as pd
 from .config import MARSConfig
 
 def _normalize_weights(vals: pd.Series | np.ndarray, index: pd.Index, floor: float | None = None) -> pd.Series:
     """Robust weight normalization with optional floor, safe to zeros."""
+    if isinstance(vals, np.ndarray):
+        # fast path: array già allineato a index, niente Series intermedie
+        v = vals.astype(float)
+        v[np.isnan(v)] = 0.0
+        if floor is not None:
+            v = np.maximum(v, floor)
+        tot = float(v.sum())
+        if not np.isfinite(tot) or tot <= 0:
+            return pd.Series(np.ones(len(index)) / max(len(index), 1), index=index, dtype=float)
+        return pd.Series(v / tot, index=index, dtype=float)
     s = pd.Series(vals, index=index, dtype=float).fillna(0.0)
     if floor is not None:
         s = s.clip(lower=floor)
@@ -15,7 +26,10 @@ def _normalize_weights(vals: pd.Series | np.ndarray, index: pd.Index, floor: flo
 
 def encounter_share(n_dir: pd.DataFrame, axis: list[str]) -> pd.Series:
     """p_enc from column sums of n_dir, renormalized on axis."""
-    col_sum = n_dir.sum(axis=0, skipna=True).reindex(axis).fillna(0.0)
+    col_all = np.nansum(n_dir.to_numpy(dtype=float), axis=0)
+    pos = n_dir.columns.get_indexer(axis)
+    col_sum = np.zeros(len(axis), dtype=float)
+    col_sum[pos >= 0] = col_all[pos[pos >= 0]]
     return _normalize_weights(col_sum, pd.Index(axis), floor=None)
 
 def _pick_share_col(df: pd.DataFrame) -> str | None:
@@ -27,21 +41,28 @@ def _pick_share_col(df: pd.DataFrame) -> str | None:
 
 # NEW: correlazione “safe” (niente warning se std=0 oppure overlap < 2)
 def _corr_safe(a: pd.Series, b: pd.Series, *, eps: float = 1e-12) -> float:
-    a = pd.to_numeric(a, errors="coerce")
-    b = pd.to_numeric(b, errors="coerce")
-    mask = a.notna() & b.notna()
-    if mask.sum() < 2:
+    a = np.asarray(pd.to_numeric(a, errors="coerce"), dtype=float)
+    b = np.asarray(pd.to_numeric(b, errors="coerce"), dtype=float)
+    mask = np.isfinite(a) & np.isfinite(b)
+    n = int(mask.sum())
+    if n < 2:
         return float("nan")
-    a = a[mask].to_numpy(dtype=float)
-    b = b[mask].to_numpy(dtype=float)
-    a = a - a.mean()
-    b = b - b.mean()
-    sa = a.std(ddof=0)
-    sb = b.std(ddof=0)
-    if not np.isfinite(sa) or not np.isfinite(sb) or sa <= eps or sb <= eps:
+    # traslazione in-place sul primo valore (r invariante): evita la cancellazione dei
+    # momenti grezzi, un vettore costante dà varianza esattamente 0
+    a = a[mask]
+    b = b[mask]
+    a -= a[0]
+    b -= b[0]
+    # momenti in un solo passaggio (niente array centrati intermedi)
+    sa, sb = float(a.sum()), float(b.sum())
+    sab, saa, sbb = float(a @ b), float(a @ a), float(b @ b)
+    var_a = max(saa - sa * sa / n, 0.0) / n
+    var_b = max(sbb - sb * sb / n, 0.0) / n
+    std_a, std_b = math.sqrt(var_a), math.sqrt(var_b)
+    if not np.isfinite(std_a) or not np.isfinite(std_b) or std_a <= eps or std_b <= eps:
         return float("nan")
     # Pearson (ddof=0, stesso convention di np.corrcoef)
-    r = float((a @ b) / (sa * sb * len(a)))
+    r = (sab - sa * sb / n) / (std_a * std_b * n)
     return r if np.isfinite(r) else float("nan")
 
 def meta_share_on_axis(
@@ -1,4 +1,6 @@
 from __future__ import annotations
+from dataclasses import replace
+import numpy as np
 import pandas as pd
 from .config import MARSConfig
 from .validate_io import validate_contract
@@ -9,6 +11,38 @@ from .mas_lb import mas_se_lb
 from .bt import bt_soft
 from .composite import compose
 from .coverage import coverage_tables
+from .core import _Arrays
+
+def _dir_counts(score_flat: pd.DataFrame, axis: list[str], cols: tuple[str, ...]) -> list[pd.DataFrame]:
+    """Somme direzionali A→B delle colonne `cols` sull'asse (come pivot_table sum + reindex):
+    un solo get_indexer sui nomi e np.add.at per colonna; celle senza righe = NaN/NA.
+    """
+    idx = pd.Index(axis)
+    ia = idx.get_indexer(score_flat["Deck A"])
+    ib = idx.get_indexer(score_flat["Deck B"])
+    keep = (ia >= 0) & (ib >= 0)
+    n = len(axis)
+    # colonne presenti nel pivot (anche via righe con Deck A fuori asse)
+    col_in_pivot = np.zeros(n, dtype=bool)
+    col_in_pivot[ib[(ib >= 0) & score_flat["Deck A"].notna().to_numpy()]] = True
+    ia, ib = ia[keep], ib[keep]
+    seen = np.zeros((n, n), dtype=bool)
+    seen[ia, ib] = True
+    out = []
+    for c in cols:
+        col = score_flat[c]
+        vals = col.to_numpy(dtype=float, na_value=np.nan)[keep]
+        ok = ~np.isnan(vals)
+        tot = np.zeros((n, n), dtype=float)
+        np.add.at(tot, (ia[ok], ib[ok]), vals[ok])
+        m = pd.DataFrame(np.where(seen, tot, np.nan),
+                         index=pd.Index(axis, name="Deck A"), columns=pd.Index(axis, name="Deck B"))
+        # pivot_table conserva Int64 (nullable) sulle colonne osservate; quelle aggiunte dal
+        # reindex restano float, gli interi NumPy diventano float con NaN
+        if isinstance(col.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(col.dtype):
+            m = m.astype({b: col.dtype for b, hit in zip(axis, col_in_pivot) if hit})
+        out.append(m)
+    return out
 
 def run_mars(filtered_wr: pd.DataFrame, n_dir: pd.DataFrame,
              score_flat: pd.DataFrame | None,
@@ -32,29 +66,38 @@ def run_mars(filtered_wr: pd.DataFrame, n_dir: pd.DataFrame,
     if score_flat is None or score_flat.empty:
         raise ValueError("score_flat (post-filtro) mancante: MARS richiede W/L reali per AUTO-K.")
     # Expect: Deck A/B, W, L
-    S = score_flat.pivot_table(index="Deck A", columns="Deck B", values="W", aggfunc="sum").reindex(index=axis, columns=axis)
-    F = score_flat.pivot_table(index="Deck A", columns="Deck B", values="L", aggfunc="sum").reindex(index=axis, columns=axis)
-    N = (S.fillna(0.0) + F.fillna(0.0)).reindex(index=axis, columns=axis)
+    S, F = _dir_counts(score_flat, axis, ("W", "L"))
+    N = S.fillna(0.0) + F.fillna(0.0)
 
     # AUTO-K
     auto_k = auto_k_cv(S, F, N, cfg); K_used = float(auto_k["K_used"])
 
+    # Viste NumPy sull'asse calcolate una volta e condivise dagli stadi successivi;
+    # OBS (N>0 off-diag) serve a MAS/LB, coverage e Opp_used qui sotto
+    N_np = N.to_numpy(dtype=float, na_value=np.nan)
+    OBS = N_np > 0.0
+    np.fill_diagonal(OBS, False)
+    arrays = _Arrays(axis=axis, S=S.to_numpy(dtype=float, na_value=np.nan),
+                     F=F.to_numpy(dtype=float, na_value=np.nan), N=N_np, OBS=OBS)
+
     # Posteriori + MAS/LB
-    p_hat, var_hat = posterior_dir(S, F, K_used, cfg)
-    mas_df = mas_se_lb(p_hat, var_hat, p_weights, N, cfg)
+    p_hat, var_hat = posterior_dir(S, F, K_used, cfg, arrays=arrays)
+    arrays = replace(arrays, P=p_hat.to_numpy(dtype=float), V=var_hat.to_numpy(dtype=float))
+    mas_df = mas_se_lb(p_hat, var_hat, p_weights, N, cfg, arrays=arrays)
 
     # BT
-    bt = bt_soft(axis, N, p_hat, K_used, cfg)
+    bt = bt_soft(axis, N, p_hat, K_used, cfg, arrays=arrays)
     bt_pct = bt["bt_pct"]
 
     # Composito
     score_pct = compose(mas_df["LB_%"], bt_pct, cfg.ALPHA_COMPOSITE)
 
     # Coverage/missing
-    coverage_df, missing_pairs_long = coverage_tables(N, axis)
+    coverage_df, missing_pairs_long = coverage_tables(N, axis, arrays=arrays)
 
     # Assemble
-    Opp_used  = (N.fillna(0.0)>0.0).sum(axis=1)
+    # come (N>0).sum(axis=1): OBS esclude la diagonale, che qui va contata se osservata
+    Opp_used  = OBS.sum(axis=1) + (np.diag(N_np) > 0.0)
     Opp_total = len(axis) - 1
     Coverage  = (Opp_used / max(Opp_total,1)) * 100.0
     N_eff     = N.sum(axis=1, skipna=True)
@@ -67,9 +110,9 @@ def run_mars(filtered_wr: pd.DataFrame, n_dir: pd.DataFrame,
         "BT_%": bt_pct.values,
         "SE_%": (mas_df["SE_%"]).values,
         "N_eff": N_eff.values,
-        "Opp_used": Opp_used.values,
+        "Opp_used": Opp_used,
         "Opp_total": int(Opp_total),
-        "Coverage_%": Coverage.values,
+        "Coverage_%": Coverage,
     }).sort_values("Score_%", ascending=False).reset_index(drop=True)
     mars_ranking.index = mars_ranking.index + 1
     mars_ranking.index.name = "Rank"
@@ -2,12 +2,15 @@ from __future__ import annotations
 import numpy as np
 import pandas as pd
 from .config import MARSConfig
+from .core import _Arrays
 
 def posterior_dir(
     S_dir: pd.DataFrame,
     F_dir: pd.DataFrame,
     K_used: float,
     cfg: MARSConfig,
+    *,
+    arrays: _Arrays | None = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Posteriori Beta–Binomiali e varianza direzionale con prior Beta(mu*K, (1-mu)*K).
@@ -20,6 +23,8 @@ def posterior_dir(
         K unico selezionato da AUTO-K-CV.
     cfg : MARSConfig
         Configurazione (usa MU ed EPS).
+    arrays : _Arrays, optional
+        Se fornito (da run_mars), usa arrays.S/F già allineati invece di reindex.
 
     Returns
     -------
@@ -30,32 +35,33 @@ def posterior_dir(
     """
     axis = list(S_dir.index)
 
-    # Matrice K costante, diag NaN
-    K = np.full((len(axis), len(axis)), float(K_used), dtype=float)
-    np.fill_diagonal(K, np.nan)
+    # Win/Loss come float, NaN→0 (nan_to_num copia: si può lavorare in place)
+    if arrays is not None:
+        S_np = np.nan_to_num(arrays.S, nan=0.0)
+        F_np = np.nan_to_num(arrays.F, nan=0.0)
+    else:
+        S_np = np.nan_to_num(S_dir.reindex(index=axis, columns=axis).to_numpy(dtype=float), nan=0.0)
+        F_np = np.nan_to_num(F_dir.reindex(index=axis, columns=axis).to_numpy(dtype=float), nan=0.0)
 
-    # Prior
-    A0 = cfg.MU * K
-    B0 = (1.0 - cfg.MU) * K
-
-    # Win/Loss come float, NaN→0
-    S_np = S_dir.reindex(index=axis, columns=axis).to_numpy(dtype=float)
-    F_np = F_dir.reindex(index=axis, columns=axis).to_numpy(dtype=float)
-    S_np = np.nan_to_num(S_np, nan=0.0)
-    F_np = np.nan_to_num(F_np, nan=0.0)
-
-    # Posterior
-    A_post = S_np + np.nan_to_num(A0, nan=0.0)
-    B_post = F_np + np.nan_to_num(B0, nan=0.0)
+    # Posterior con prior scalare Beta(mu*K, (1-mu)*K): α = W + mu*K, β = L + (1-mu)*K
+    A_post = S_np
+    A_post += cfg.MU * float(K_used)
+    B_post = F_np
+    B_post += (1.0 - cfg.MU) * float(K_used)
     den = A_post + B_post
 
+    # p̂ = α/(α+β);  Var = αβ/((α+β)²(α+β+1)) = p̂ · (β/(α+β)) / (α+β+1), senza quadrato
     with np.errstate(divide="ignore", invalid="ignore"):
         p_hat_np = A_post / den
-        var_hat_np = (A_post * B_post) / (den ** 2 * (den + 1.0))
+        var_hat_np = B_post
+        var_hat_np /= den
+        var_hat_np *= p_hat_np
+        den += 1.0
+        var_hat_np /= den
 
+    np.fill_diagonal(p_hat_np, np.nan)
+    np.fill_diagonal(var_hat_np, np.nan)
     p_hat = pd.DataFrame(p_hat_np, index=axis, columns=axis)
     var_hat = pd.DataFrame(var_hat_np, index=axis, columns=axis)
-    for df_ in (p_hat, var_hat):
-        np.fill_diagonal(df_.values, np.nan)
 
     return p_hat, var_hat
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Iterable, Optional, Tuple
 from pathlib import Path
 import logging
@@ -9,7 +10,7 @@ import logging
 import numpy as np
 import pandas as pd
 
-from utils.io import write_excel_versioned_styled  # writer con styling/CF
+from utils.io import copy_file_atomic, write_excel_versioned_styled, write_workbook_tables  # writer con styling/CF
 
 LOGGER = logging.getLogger("ptcgp")
 _PCT = 100.0
@@ -18,108 +19,199 @@ _PCT = 100.0
 # ──────────────────────────────────────────────────────────────────────────────
 # Helpers base
 # ──────────────────────────────────────────────────────────────────────────────
+_BAD_SHEET_CHARS = str.maketrans("", "", '[]:*?/\\')
+
+
+@lru_cache(maxsize=None)
 def _sanitize_sheet_name(name: str) -> str:
     """Excel: max 31 char, no []:*?/\\ ."""
-    bad = set('[]:*?/\\')
-    safe = "".join(ch for ch in str(name) if ch not in bad).strip()
+    safe = str(name).translate(_BAD_SHEET_CHARS).strip()
     return (safe or "Sheet")[:31]
 
 
-def _ensure_axis(df: pd.DataFrame, axis: Iterable[str]) -> pd.DataFrame:
-    axis = list(axis)
+def _pair_positions(score_flat: pd.DataFrame, axis: list[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Posizioni (riga, colonna) sull'asse delle righe A→B di score_flat che cadono nell'asse.
+    Ritorna (mask righe tenute, ia, ib). Coppie duplicate → ValueError (come pivot).
+    """
+    idx = pd.Index(axis)
+    ia = idx.get_indexer(score_flat["Deck A"])
+    ib = idx.get_indexer(score_flat["Deck B"])
+    keep = (ia >= 0) & (ib >= 0)
+    ia, ib = ia[keep], ib[keep]
+    if ia.size and np.bincount(ia * len(axis) + ib).max() > 1:
+        raise ValueError("Index contains duplicate entries, cannot reshape")
+    return keep, ia, ib
+
+
+def _on_axis(df: pd.DataFrame, axis: list[str]) -> pd.DataFrame:
+    """df su index=columns=axis; reindex (copia) solo se non già allineato."""
+    if list(df.index) == axis and list(df.columns) == axis:
+        return df
     return df.reindex(index=axis, columns=axis)
 
 
-def _wr_real_from_score(score_flat: pd.DataFrame, axis: Iterable[str]) -> pd.DataFrame:
-    """Matrice WR_real_% T×T (direzionale A→B) da score_latest (flat)."""
+def _int64_array(vals: np.ndarray) -> pd.arrays.IntegerArray:
+    """Colonna Int64 da float con NaN: IntegerArray(valori, maschera) diretto, senza coercizione.
+    Valori non interi → stesso TypeError del cast pandas.
+    """
+    mask = np.isnan(vals)
+    filled = np.where(mask, 0.0, vals)
+    ints = filled.astype(np.int64)
+    if not np.array_equal(ints, filled):
+        return pd.array(vals, dtype="Int64")  # solleva TypeError come prima
+    return pd.arrays.IntegerArray(ints, mask)
+
+
+def _axis_frame(mat: np.ndarray, axis: list[str]) -> pd.DataFrame:
+    return pd.DataFrame(mat, index=pd.Index(axis, name="Deck A"), columns=pd.Index(axis, name="Deck B"))
+
+
+def _wr_real_from_score(score_flat: pd.DataFrame, axis: Iterable[str],
+                        pos: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> pd.DataFrame:
+    """Matrice WR_real_% T×T (direzionale A→B) da score_latest (flat): scatter posizionale, niente pivot.
+    `pos`: (keep, ia, ib) già calcolati da _pair_positions sullo stesso asse, se disponibili.
+    """
     need = {"Deck A", "Deck B", "WR_dir"}
     missing = need.difference(score_flat.columns)
     if missing:
         raise ValueError(f"score_flat mancano colonne: {sorted(missing)}")
 
-    wr_pivot = (
-        score_flat.astype({"Deck A": "string", "Deck B": "string"})
-        .pivot(index="Deck A", columns="Deck B", values="WR_dir")
-    )
-    wr_pivot = _ensure_axis(wr_pivot, axis)
-    np.fill_diagonal(wr_pivot.values, np.nan)
-    return wr_pivot
+    axis = list(axis)
+    keep, ia, ib = pos if pos is not None else _pair_positions(score_flat, axis)
+    mat = np.full((len(axis), len(axis)), np.nan, dtype=np.float64)
+    mat[ia, ib] = score_flat["WR_dir"].to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+    np.fill_diagonal(mat, np.nan)
+    return _axis_frame(mat, axis)
 
 
-def _counts_from_score(score_flat: pd.DataFrame, axis: Iterable[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    """Matrici W e L T×T da score_latest (flat)."""
+def _counts_from_score(score_flat: pd.DataFrame, axis: Iterable[str],
+                       pos: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Matrici W e L T×T da score_latest (flat): uno scatter per colonna, celle assenti = 0, diag NaN.
+    `pos` come in _wr_real_from_score.
+    """
     need = {"Deck A", "Deck B", "W", "L"}
     missing = need.difference(score_flat.columns)
     if missing:
         raise ValueError(f"score_flat mancano colonne: {sorted(missing)}")
 
-    W = (
-        score_flat.pivot(index="Deck A", columns="Deck B", values="W")
-        .reindex(index=axis, columns=axis)
-        .fillna(0.0).astype(float)
-    )
-    L = (
-        score_flat.pivot(index="Deck A", columns="Deck B", values="L")
-        .reindex(index=axis, columns=axis)
-        .fillna(0.0).astype(float)
-    )
-    np.fill_diagonal(W.values, np.nan)
-    np.fill_diagonal(L.values, np.nan)
-    return W, L
+    axis = list(axis)
+    keep, ia, ib = pos if pos is not None else _pair_positions(score_flat, axis)
+    out = []
+    for c in ("W", "L"):
+        mat = np.zeros((len(axis), len(axis)), dtype=np.float64)
+        vals = score_flat[c].to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+        mat[ia, ib] = np.where(np.isnan(vals), 0.0, vals)
+        np.fill_diagonal(mat, np.nan)
+        out.append(_axis_frame(mat, axis))
+    return out[0], out[1]
 
 
 def _posterior_from_wr_n(
-    wr_dir_pct: pd.DataFrame,
-    n_dir: pd.DataFrame,
+    wr_dir_pct: np.ndarray,
+    n_dir: np.ndarray,
     *,
     mu: float,
     K: float,
-) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    binom_se: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
     """
-    Posteriori Beta su ogni cella A→B usando p_obs e N:
+    Posteriori Beta su ogni cella A→B usando p_obs e N (array T×T allineati sullo stesso asse):
       a = mu*K + W,  b = (1-mu)*K + L, con W = p_obs*N, L = (1-p_obs)*N
-    Restituisce: p_hat_% (T×T) e SE_dir_% (T×T) = 100*sqrt(Var[Beta(a,b)]).
+    Restituisce: p_hat_% (T×T), SE_dir_% (T×T) = 100*sqrt(Var[Beta(a,b)]) e, se `binom_se`,
+    SE_binom_% = 100·sqrt(p(1-p)/N_dir) (NaN se N_dir==0), altrimenti None.
+    Un solo passaggio: p_obs e 1-p_obs sono condivisi tra posterior e SE binomiale.
     """
-    if set(wr_dir_pct.columns) != set(n_dir.columns) or set(wr_dir_pct.index) != set(n_dir.index):
+    if wr_dir_pct.shape != n_dir.shape:
         raise ValueError("wr_dir_pct e n_dir non condividono lo stesso asse.")
 
     p_obs = wr_dir_pct / _PCT
-    N = n_dir.astype(float)
-
-    a = mu * K + (p_obs * N)
-    b = (1.0 - mu) * K + ((1.0 - p_obs) * N)
+    b = 1.0 - p_obs
+
+    se_binom = None
+    if binom_se:
+        pq = p_obs * b
+        # divisione solo dove N_dir>0 (niente inf/NaN da 0/0 da ripulire), resto NaN
+        se_binom = np.full_like(pq, np.nan)
+        np.divide(pq, n_dir, out=se_binom, where=n_dir > 0)
+        np.maximum(se_binom, 0.0, out=se_binom)
+        np.sqrt(se_binom, out=se_binom)
+        se_binom *= _PCT
+
+    a = p_obs * n_dir
+    a += mu * K
+    b *= n_dir
+    b += (1.0 - mu) * K
     denom = a + b
 
     p_hat = a / denom
-    var = (a * b) / (denom.pow(2) * (denom + 1.0))
-    se = np.sqrt(var)
-
-    return (p_hat * _PCT), (se * _PCT)
-
+    var = a * b
+    a = denom * denom
+    denom += 1.0
+    a *= denom
+    var /= a
+    se = np.sqrt(var, out=var)
 
-def _se_binom_from_wr_n(wr_dir_pct: pd.DataFrame, n_dir: pd.DataFrame) -> pd.DataFrame:
-    """SE binomiale della proporzione osservata: 100·sqrt(p(1-p)/N_dir). NaN se N_dir==0."""
-    p = wr_dir_pct / _PCT
-    N = n_dir.astype(float)
-    with np.errstate(divide="ignore", invalid="ignore"):
-        se = np.sqrt(np.clip(p * (1.0 - p) / N, 0.0, None))
-    return se * _PCT
+    p_hat *= _PCT
+    se *= _PCT
+    return p_hat, se, se_binom
 
 
-def _weights_row_for_A(p_blend: pd.Series, A: str, axis: Iterable[str]) -> pd.Series:
-    """Rinormalizza i pesi meta-blend su B≠A; somma=1."""
+def _weights_matrix(p_blend: pd.Series, axis: Iterable[str]) -> np.ndarray:
+    """Pesi meta-blend w_A(B) rinormalizzati su B≠A per tutte le righe A in un colpo (T×T, somma riga=1).
+    Righe con massa ≤0 → uniforme 1/(T−1) fuori diagonale; i NaN di p_blend restano NaN.
+    """
     axis = list(axis)
-    w = p_blend.reindex(axis).astype(float).copy()
-    w.loc[A] = 0.0
-    s = w.sum()
-    if s <= 0:
-        n_opp = max(len(axis) - 1, 1)
-        w = pd.Series({b: (0.0 if b == A else 1.0 / n_opp) for b in axis}, dtype=float)
-    else:
-        w /= s
+    T = len(axis)
+    pv = p_blend.reindex(axis).to_numpy(dtype=np.float64, na_value=np.nan)
+    w = np.broadcast_to(pv, (T, T)).copy()
+    np.fill_diagonal(w, 0.0)
+    s = np.nansum(w, axis=1)
+    bad = ~(s > 0)
+    s[bad] = 1.0
+    w /= s[:, None]
+    if bad.any():
+        w[bad] = 1.0 / max(T - 1, 1)
+        w[bad, np.flatnonzero(bad)] = 0.0
     return w
 
 
+# Testi fissi della legenda (Campo, Descrizione): costanti di modulo, solo le righe
+# dipendenti dai flag/parametri si compongono a ogni chiamata
+_PER_DECK_LEGEND = (
+    ("Unità", "Percentuali con 2 decimali. 'pp' = punti percentuali. W/L/N sono conteggi direzionali (A→B)."),
+    ("W,L,N", "W=vittorie, L=sconfitte, N=W+L (A→B; i pareggi non entrano nella WR osservata)."),
+    ("WR_real_%", "Winrate osservata: 100·W/(W+L), dopo alias e filtri."),
+    ("p_hat_%", "Winrate corretta per pochi dati: 100·(W+μK)/(W+L+K), con μ=0.5 e K scelto automaticamente."),
+    ("SE_binom_%", "Errore standard della WR osservata: 100·√(p·(1−p)/N_dir). NaN se N_dir=0."),
+    ("gap_pp", "Correzione applicata: p_hat_% − WR_real_% (positiva = alza; negativa = abbassa)."),
+    ("Mirror", "Riga del mazzo A contro se stesso (per leggibilità): campi vuoti."),
+)
+_LEGEND_SE_DIR = ("SE_dir_%", "Incertezza della stima corretta (dev. standard); definita anche con N piccolo).")
+_LEGEND_WEIGHT = ("w_A(B)_%", "Quanto pesa il mazzo B nella media di A (pesi meta-blend; sommano ≈100 su B≠A).")
+_LEGEND_MAS_CONTRIB = ("MAS_contrib_pp", "Contributo di B alla resa attesa di A: w_A(B)% × p_hat_% / 100. La somma ricostruisce MAS_% di A.")
+
+# Sezione ranking (01_Summary)
+_RANKING_LEGEND = (
+    ("Deck", "Nome del mazzo (già unificato con gli alias)."),
+    ("Score_%", "Voto finale (0–100): mix di LB_% (stima prudente) e BT_% (forza dagli scontri diretti)."),
+    ("MAS_%", "Resa attesa contro il meta attuale: media pesata delle chance di vittoria."),
+    ("SE_%", "Margine d’incertezza su MAS_%: alto = dati scarsi o molto variabili."),
+    ("LB_%", "Stima prudente: MAS_% − z·SE_% (z≈1.2). Penalizza chi ha pochi dati."),
+    ("BT_%", "Forza dagli scontri diretti (modello Bradley–Terry robusto ai buchi)."),
+    ("Coverage_%", "Copertura dei matchup osservati: % di avversari affrontati sul totale."),
+    ("N_eff", "Volume totale considerato: somma di W+L su tutti gli avversari."),
+    ("Opp_used / Opp_total", "Avversari distinti affrontati / avversari totali nel report."),
+)
+
+# Legenda colori (Campo, Descrizione, Colore)
+_COLOR_LEGEND = (
+    ("|gap_pp| ≥ 8",     "Scostamento forte (attenzione)",  "RED"),
+    ("4 ≤ |gap_pp| < 8", "Scostamento moderato",            "YELLOW"),
+    ("Mirror",           "Riga del mazzo stesso",           "GRAY"),
+)
+_COLOR_TOPK = ("Top-K MAS_contrib_pp", "Contributi principali (K=5)", "GREEN")
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Tabelle per-deck + Legenda (data-only; nessun I/O)
 # ──────────────────────────────────────────────────────────────────────────────
@@ -149,152 +241,142 @@ def make_pairs_by_deck_tables(
       - meta: info varie
     """
     axis: list[str] = list(filtered_wr.columns)
-    filtered_wr = filtered_wr.reindex(index=axis, columns=axis)
-    n_dir = n_dir.reindex(index=axis, columns=axis)
-    p_blend = p_blend.reindex(axis).astype(float)
+    # reindex (copia T×T) solo se l'input non è già allineato sull'asse
+    filtered_wr = _on_axis(filtered_wr, axis)
+    n_dir = _on_axis(n_dir, axis)
+    if list(p_blend.index) != axis:
+        p_blend = p_blend.reindex(axis)
+    p_blend = p_blend.astype(float)
 
     # WR reale e (opz) conteggi W/L
     if score_flat is not None:
-        wr_real_pct = _wr_real_from_score(score_flat, axis)
-        W_mat, L_mat = _counts_from_score(score_flat, axis) if include_counts else (None, None)
+        # righe fuori asse scartate una sola volta: posizioni condivise da WR e conteggi
+        pos = (_pair_positions(score_flat, axis)
+               if {"Deck A", "Deck B", "WR_dir"} <= set(score_flat.columns) else None)
+        wr_real_pct = _wr_real_from_score(score_flat, axis, pos)
+        W_mat, L_mat = _counts_from_score(score_flat, axis, pos) if include_counts else (None, None)
     else:
-        wr_real_pct = filtered_wr.copy()
+        wr_real_pct = filtered_wr  # solo letto (to_numpy più sotto)
         W_mat, L_mat = (None, None)
 
-    # Posteriori + SE posterior (Beta)
-    p_hat_pct, se_post_pct = _posterior_from_wr_n(wr_real_pct, n_dir, mu=mu, K=K_used)
-
-    # SE binomiale
-    se_binom_pct = _se_binom_from_wr_n(wr_real_pct, n_dir)
-
     # Ordine fisso righe (uguale per tutti i fogli)
     order = list(global_order) if global_order is not None else list(axis)
 
+    axis_set = set(axis)
+    missing_order = [b for b in order if b not in axis_set]
+    if missing_order:
+        raise KeyError(f"global_order contiene deck fuori asse: {missing_order[:5]}")
+    order_arr = np.asarray(order, dtype=object)
+    with_counts = include_counts and (W_mat is not None) and (L_mat is not None)
+    need_weights = include_weight_col or include_mas_contrib_col
+
+    # matrici T×T (tutte sull'asse) come ndarray float, lette per posizione intera.
+    # to_numpy di un blocco pandas è tipicamente F-order (colonne contigue): si forza il
+    # C-order una volta, così ogni arr[i, ...] del loop per-deck legge una riga contigua
+    axis_to_idx = {name: i for i, name in enumerate(axis)}
+    order_idx = np.array([axis_to_idx[b] for b in order], dtype=np.intp)
+
+    def _c(df: pd.DataFrame) -> np.ndarray:
+        return np.ascontiguousarray(df.to_numpy(dtype=np.float64, na_value=np.nan))
+
+    wr_arr = _c(wr_real_pct)
+    n_arr = _c(n_dir)
+
+    # Posteriori + SE posterior (Beta) e SE binomiale, in un solo blocco NumPy su T×T
+    ph_arr, se_post_arr, se_binom_arr = _posterior_from_wr_n(
+        wr_arr, n_arr, mu=mu, K=K_used, binom_se=include_binom_se)
+    W_arr = _c(W_mat) if with_counts else None
+    L_arr = _c(L_mat) if with_counts else None
+
+    # Tutte le righe (A, B) in un'unica tabella lunga T·|order| (blocchi per A nell'ordine
+    # di axis, dentro ogni blocco l'ordine fisso), poi split per A a fine build
+    T = len(axis)
+    ri = np.repeat(np.arange(T, dtype=np.intp), len(order))   # riga (A) sull'asse
+    ci = np.tile(order_idx, T)                                 # colonna (B) sull'asse
+    opp = np.tile(order_arr, T)
+    mirror = ri == ci
+    if not include_self_row:
+        ri, ci, opp, mirror = ri[~mirror], ci[~mirror], opp[~mirror], mirror[~mirror]
+
+    def _flat(arr: np.ndarray) -> np.ndarray:
+        v = arr[ri, ci]
+        v[mirror] = np.nan
+        return v
+
+    cols: Dict[str, object] = {"Opponent": np.where(mirror, mirror_label, opp)}
+    if with_counts:
+        W_flat = _flat(W_arr); L_flat = _flat(L_arr)
+        cols.update({"W": W_flat, "L": L_flat, "N": W_flat + L_flat})
+    wr_flat = _flat(wr_arr)
+    ph_flat = _flat(ph_arr)
+    cols.update({"WR_real_%": wr_flat, "p_hat_%": ph_flat})
+    if include_posterior_se: cols["SE_dir_%"] = _flat(se_post_arr)
+    if include_binom_se:     cols["SE_binom_%"] = _flat(se_binom_arr)
+    cols["gap_pp"] = ph_flat - wr_flat
+
+    if need_weights:
+        w_flat = _weights_matrix(p_blend, axis)[ri, ci] * _PCT
+        if include_weight_col:
+            cols["w_A(B)_%"] = np.where(mirror, 0.0, w_flat)
+        if include_mas_contrib_col:
+            cols["MAS_contrib_pp"] = np.where(mirror, 0.0, w_flat * ph_flat / _PCT)
+
+    # Se non usiamo global_order, permettiamo sort_by per-foglio: permutazione unica sugli array
+    # (blocco A, poi chiave decrescente con NaN in coda; lexsort è stabile come il mergesort)
+    if global_order is None and sort_by and sort_by in cols:
+        key = cols[sort_by]
+        if sort_by == "Opponent":
+            _, codes = np.unique(key, return_inverse=True)
+            perm = np.lexsort((-codes, ri))
+        else:
+            nan_key = np.isnan(key)
+            perm = np.lexsort((np.where(nan_key, 0.0, -key), nan_key, ri))
+        cols = {c: v[perm] for c, v in cols.items()}
+
+    # Tipi/rounding sugli array prima della costruzione (arrotondamento dopo il sort, come prima):
+    # percentuali a 2 decimali, conteggi in Int64 (NaN → NA)
+    big = pd.DataFrame({
+        c: (_int64_array(v) if c in ("W", "L", "N")
+            else v if c == "Opponent"
+            else np.round(v, 2))
+        for c, v in cols.items()
+    })
+
+    # Split per A: blocchi contigui, limiti da bincount sulle righe tenute
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(ri, minlength=T))])
     sheets: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
-    for A in axis:
-        rows = []
-        need_weights = include_weight_col or include_mas_contrib_col
-        w_row = _weights_row_for_A(p_blend, A, axis) if need_weights else None
-
-        for B in order:
-            # Riga Mirror
-            if B == A and include_self_row:
-                row = {"Opponent": mirror_label}
-                if include_counts and (W_mat is not None) and (L_mat is not None):
-                    row.update({"W": pd.NA, "L": pd.NA, "N": pd.NA})
-                row.update({"WR_real_%": np.nan, "p_hat_%": np.nan})
-                if include_posterior_se: row["SE_dir_%"] = np.nan
-                if include_binom_se:     row["SE_binom_%"] = np.nan
-                row["gap_pp"] = np.nan
-                if include_weight_col:      row["w_A(B)_%"] = 0.0
-                if include_mas_contrib_col: row["MAS_contrib_pp"] = 0.0
-                rows.append(row)
-                continue
-            if B == A and not include_self_row:
-                continue
-
-            # Riga normale A→B
-            row = {"Opponent": B}
-            if include_counts and (W_mat is not None) and (L_mat is not None):
-                Wv = W_mat.loc[A, B]; Lv = L_mat.loc[A, B]
-                Nv = (Wv + Lv) if pd.notna(Wv) and pd.notna(Lv) else np.nan
-                row.update({"W": Wv, "L": Lv, "N": Nv})
-
-            wr_ab = wr_real_pct.loc[A, B]
-            ph_ab = p_hat_pct.loc[A, B]
-            row.update({"WR_real_%": wr_ab, "p_hat_%": ph_ab})
-            if include_posterior_se: row["SE_dir_%"] = se_post_pct.loc[A, B]
-            if include_binom_se:     row["SE_binom_%"] = se_binom_pct.loc[A, B]
-
-            row["gap_pp"] = (ph_ab - wr_ab)
-
-            if need_weights:
-                wB = float(w_row.loc[B]) * _PCT
-                if include_weight_col:
-                    row["w_A(B)_%"] = wB
-                if include_mas_contrib_col:
-                    row["MAS_contrib_pp"] = (wB * ph_ab / _PCT)
-
-            rows.append(row)
-
-        df = pd.DataFrame(rows)
-
-        # Se non usiamo global_order, permettiamo sort_by per-foglio
-        if global_order is None and sort_by and sort_by in df.columns:
-            df = df.sort_values(by=sort_by, ascending=False, kind="mergesort").reset_index(drop=True)
-
-        # Tipi/rounding
-        for col in df.columns:
-            if col in ("W", "L", "N"):
-                df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
-            elif col != "Opponent":
-                df[col] = pd.to_numeric(df[col], errors="coerce").round(2)
-
-        sheets[A] = df
+    for i, A in enumerate(axis):
+        lo, hi = int(bounds[i]), int(bounds[i + 1])
+        sheets[A] = big.iloc[lo:hi].reset_index(drop=True) if hi > lo else pd.DataFrame([])
 
     # ---------- LEGENDA (testo “catchy”) ----------
     # Copertina: Che cos'è
     catchy = (f"Questo file presenta il ranking dei Top {len(axis)} mazzi in '01_Summary'. "
               "Poi trovi un foglio per ogni mazzo A: A contro tutti gli altri, nello stesso ordine del ranking.")
     # Colonne dei fogli per-deck (solo quelle effettivamente presenti)
-    per_deck_rows = [
-        ("Unità", "Percentuali con 2 decimali. 'pp' = punti percentuali. W/L/N sono conteggi direzionali (A→B)."),
-        ("W,L,N", "W=vittorie, L=sconfitte, N=W+L (A→B; i pareggi non entrano nella WR osservata)."),
-        ("WR_real_%", "Winrate osservata: 100·W/(W+L), dopo alias e filtri."),
-        ("p_hat_%", "Winrate corretta per pochi dati: 100·(W+μK)/(W+L+K), con μ=0.5 e K scelto automaticamente."),
-        ("SE_binom_%", "Errore standard della WR osservata: 100·√(p·(1−p)/N_dir). NaN se N_dir=0."),
-        ("gap_pp", "Correzione applicata: p_hat_% − WR_real_% (positiva = alza; negativa = abbassa)."),
-        ("Mirror", "Riga del mazzo A contro se stesso (per leggibilità): campi vuoti."),
-    ]
-    if include_posterior_se:
-        per_deck_rows.insert(4, ("SE_dir_%", "Incertezza della stima corretta (dev. standard); definita anche con N piccolo)."))
-    if include_weight_col:
-        per_deck_rows.insert(-1, ("w_A(B)_%", "Quanto pesa il mazzo B nella media di A (pesi meta-blend; sommano ≈100 su B≠A)."))
-    if include_mas_contrib_col:
-        per_deck_rows.insert(-1, ("MAS_contrib_pp", "Contributo di B alla resa attesa di A: w_A(B)% × p_hat_% / 100. La somma ricostruisce MAS_% di A."))
-
-    legend_df = pd.DataFrame(
-        [("Che cos'è", catchy)] + per_deck_rows
-        + [("Parametri run", f"T={len(axis)}; mu={mu}; K_used={K_used}" + (f"; gamma={gamma}" if gamma is not None else "")),
-           ("Convenzioni", "Stesso ordine righe per tutti i fogli (quello del ranking).")],
-        columns=["Campo", "Descrizione"]
+    per_deck_rows = (
+        _PER_DECK_LEGEND[:4]
+        + ((_LEGEND_SE_DIR,) if include_posterior_se else ())
+        + _PER_DECK_LEGEND[4:6]
+        + ((_LEGEND_WEIGHT,) if include_weight_col else ())
+        + ((_LEGEND_MAS_CONTRIB,) if include_mas_contrib_col else ())
+        + _PER_DECK_LEGEND[6:]
     )
-    legend_df["Colore"] = pd.NA
-
-    # Sezione ranking (01_Summary)
-    ranking_legend_rows = [
-        ("Deck", "Nome del mazzo (già unificato con gli alias)."),
-        ("Score_%", "Voto finale (0–100): mix di LB_% (stima prudente) e BT_% (forza dagli scontri diretti)."),
-        ("MAS_%", "Resa attesa contro il meta attuale: media pesata delle chance di vittoria."),
-        ("SE_%", "Margine d’incertezza su MAS_%: alto = dati scarsi o molto variabili."),
-        ("LB_%", "Stima prudente: MAS_% − z·SE_% (z≈1.2). Penalizza chi ha pochi dati."),
-        ("BT_%", "Forza dagli scontri diretti (modello Bradley–Terry robusto ai buchi)."),
-        ("Coverage_%", "Copertura dei matchup osservati: % di avversari affrontati sul totale."),
-        ("N_eff", "Volume totale considerato: somma di W+L su tutti gli avversari."),
-        ("Opp_used / Opp_total", "Avversari distinti affrontati / avversari totali nel report."),
-    ]
-    ranking_legend_df = pd.DataFrame(ranking_legend_rows, columns=["Campo", "Descrizione"])
-    ranking_legend_df["Colore"] = pd.NA
-
-    # Legenda colori
-    color_rows = [
-        {"Campo": "|gap_pp| ≥ 8",     "Descrizione": "Scostamento forte (attenzione)",  "Colore": "RED"},
-        {"Campo": "4 ≤ |gap_pp| < 8", "Descrizione": "Scostamento moderato",            "Colore": "YELLOW"},
-        {"Campo": "Mirror",           "Descrizione": "Riga del mazzo stesso",           "Colore": "GRAY"},
-    ]
-    if include_mas_contrib_col:
-        color_rows.insert(2, {"Campo": "Top-K MAS_contrib_pp", "Descrizione": "Contributi principali (K=5)", "Colore": "GREEN"})
-    legend_colors = pd.DataFrame(color_rows, columns=["Campo", "Descrizione", "Colore"])
-
-    legend_df = pd.concat(
-        [
-            legend_df,
-            pd.DataFrame([{"Campo": "", "Descrizione": "Legenda ranking (01_Summary)", "Colore": pd.NA}]),
-            ranking_legend_df,
-            pd.DataFrame([{"Campo": "", "Descrizione": "Legenda colori", "Colore": pd.NA}]),
-            legend_colors,
-        ],
-        ignore_index=True
+    # Legenda colori (GREEN solo se c'è la colonna MAS_contrib_pp)
+    color_rows = _COLOR_LEGEND[:2] + ((_COLOR_TOPK,) if include_mas_contrib_col else ()) + _COLOR_LEGEND[2:]
+
+    # Legenda completa: un'unica lista di record → un solo costruttore (niente concat)
+    text_rows = (
+        (("Che cos'è", catchy),) + per_deck_rows
+        + (("Parametri run", f"T={len(axis)}; mu={mu}; K_used={K_used}" + (f"; gamma={gamma}" if gamma is not None else "")),
+           ("Convenzioni", "Stesso ordine righe per tutti i fogli (quello del ranking)."),
+           ("", "Legenda ranking (01_Summary)"))
+        + _RANKING_LEGEND
+        + (("", "Legenda colori"),)
+    )
+    legend_df = pd.DataFrame(
+        [(c, d, np.nan) for c, d in text_rows] + list(color_rows),
+        columns=["Campo", "Descrizione", "Colore"],
     )
 
     meta = {
@@ -312,13 +394,26 @@ def make_pairs_by_deck_tables(
 # ──────────────────────────────────────────────────────────────────────────────
 # Summary + Workbook (data-only)
 # ──────────────────────────────────────────────────────────────────────────────
-def build_summary_sheet(ranking_df: pd.DataFrame) -> pd.DataFrame:
-    """Costruisce il foglio 01_Summary dal ranking MARS (ordinato per Score_%)."""
+def build_summary_sheet(ranking_df: pd.DataFrame, order: Optional[list[str]] = None) -> pd.DataFrame:
+    """Costruisce il foglio 01_Summary dal ranking MARS (ordinato per Score_%).
+
+    `order`: nomi dei deck già ordinati (es. ranking_order del chiamante); se copre tutti i
+    deck (unici) si usa come permutazione, senza riordinare di nuovo per Score_%.
+    """
     keep_cols = ["Deck", "Score_%", "MAS_%", "LB_%", "BT_%", "SE_%", "N_eff", "Opp_used", "Opp_total", "Coverage_%"]
     cols = [c for c in keep_cols if c in ranking_df.columns]
-    df = (ranking_df.loc[:, cols].copy()
-          .sort_values("Score_%", ascending=False, kind="mergesort")
-          .reset_index(drop=True))
+    df = ranking_df.loc[:, cols]
+    pos = None
+    if order is not None and "Deck" in df.columns and len(order) == len(df):
+        names = pd.Index(df["Deck"].astype(str))
+        if names.is_unique:
+            pos = names.get_indexer(order)
+            if (pos < 0).any():
+                pos = None
+    if pos is not None:
+        df = df.take(pos).reset_index(drop=True)
+    else:
+        df = df.sort_values("Score_%", ascending=False, kind="mergesort").reset_index(drop=True)
     for c in ("Score_%", "MAS_%", "LB_%", "BT_%", "SE_%", "Coverage_%"):
         if c in df.columns:
             df[c] = pd.to_numeric(df[c], errors="coerce").round(2)
@@ -331,17 +426,30 @@ def prepare_workbook(
     summary_df: Optional[pd.DataFrame] = None,
     *,
     include_legend_table: bool = False,
+    deck_order: Optional[Iterable[str]] = None,
 ) -> "OrderedDict[str, pd.DataFrame]":
     """
     Inserisce '00_Legenda' come primo foglio (vuoto se include_legend_table=False)
-    e, se fornito, '01_Summary' come secondo. Poi un foglio per ogni deck A.
+    e, se fornito, '01_Summary' come secondo. Poi un foglio per ogni deck A:
+    nell'ordine di deck_order se passato (es. ranking; i deck non elencati in coda),
+    altrimenti in quello di sheets_by_deck. Il writer conserva l'ordine del dict.
     """
     workbook: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
     workbook["00_Legenda"] = legend_df.copy() if include_legend_table else pd.DataFrame({"": []})
     if summary_df is not None:
         workbook["01_Summary"] = summary_df.copy()
-    for deck, df in sheets_by_deck.items():
-        workbook[_sanitize_sheet_name(deck)] = df
+    decks = list(sheets_by_deck)
+    if deck_order is not None:
+        ordered = []
+        for deck in deck_order:
+            if deck in sheets_by_deck:
+                ordered.append(deck)
+            else:
+                LOGGER.warning("Ordine fogli: nessun foglio per '%s'.", deck)
+        seen = set(ordered)
+        decks = ordered + [d for d in decks if d not in seen]
+    for deck in decks:
+        workbook[_sanitize_sheet_name(deck)] = sheets_by_deck[deck]
     return workbook
 
 
@@ -396,6 +504,8 @@ def _render_legend_banner_png(
     f_key   = _load_font("bold", 18)
     f_txt   = _load_font("regular", 18)
     f_meta  = _load_font("regular", 16)
+    # altezza riga (ascent+descent) per font, calcolata una volta
+    LH = {f: sum(f.getmetrics()) for f in (f_title, f_h2, f_key, f_txt, f_meta)}
 
     # Canvas (height grande, poi crop)
     W = int(width)
@@ -420,8 +530,7 @@ def _render_legend_banner_png(
                 cur = w
         if cur:
             lines.append(cur)
-        ascent, descent = font.getmetrics()
-        line_h = ascent + descent + line_spacing
+        line_h = LH[font] + line_spacing
         for ln in lines:
             d.text((x, y), ln, font=font, fill=color)
             y += line_h
@@ -482,13 +591,13 @@ def _render_legend_banner_png(
 
     # Titolo
     d.text((x, y), "Legenda — come leggere il report per-deck", font=f_title, fill=COLS["TEXT"])
-    y += f_title.getmetrics()[0] + f_title.getmetrics()[1] + 16
+    y += LH[f_title] + 16
     if param_text:
         y = draw_wrapped(f"Parametri run: {param_text}", f_meta, x, y, max_w, COLS["SUB"], 4) + 8
 
     # 1) Che cos'è (callout)
     d.text((x, y), "Che cos'è", font=f_h2, fill=COLS["TEXT"])
-    y += f_h2.getmetrics()[0] + f_h2.getmetrics()[1] + 10
+    y += LH[f_h2] + 10
     box_h = 140
     d.rounded_rectangle([x, y, x + max_w, y + box_h], radius=14, fill=COLS["CALLOUT"], outline=COLS["BORDER"])
     draw_wrapped(che_text, f_txt, x + 16, y + 14, max_w - 32, COLS["TEXT"])
@@ -496,7 +605,7 @@ def _render_legend_banner_png(
 
     # 2) 01_Summary
     d.text((x, y), "01_Summary (ranking)", font=f_h2, fill=COLS["TEXT"])
-    y += f_h2.getmetrics()[0] + f_h2.getmetrics()[1] + 10
+    y += LH[f_h2] + 10
     key_w = 260
     for row in ranking_items:
         campo, descr = str(row["Campo"]), str(row["Descrizione"])
@@ -507,7 +616,7 @@ def _render_legend_banner_png(
 
     # 3) Fogli per deck
     d.text((x, y), "Fogli per deck (A→tutti)", font=f_h2, fill=COLS["TEXT"])
-    y += f_h2.getmetrics()[0] + f_h2.getmetrics()[1] + 10
+    y += LH[f_h2] + 10
     for row in per_deck_items:
         campo, descr = str(row["Campo"]), str(row["Descrizione"])
         d.text((x, y), campo, font=f_key, fill=COLS["TEXT"])
@@ -517,13 +626,13 @@ def _render_legend_banner_png(
 
     # 4) Legenda colori
     d.text((x, y), "Legenda colori", font=f_h2, fill=COLS["TEXT"])
-    y += f_h2.getmetrics()[0] + f_h2.getmetrics()[1] + 12
+    y += LH[f_h2] + 12
     sw_w, sw_h = 68, 36
     for _, r in color_block.iterrows():
         label, descr, key = r["Campo"], r["Descrizione"], r["Colore"]
         d.rounded_rectangle([x, y, x + sw_w, y + sw_h], radius=8, fill=COLS.get(key, "#EEEEEE"), outline="#999999")
         d.text((x + sw_w + 14, y), str(label), font=f_key, fill=COLS["TEXT"])
-        y = draw_wrapped(str(descr), f_txt, x + sw_w + 14, y + f_key.getmetrics()[0] + f_key.getmetrics()[1] + 6,
+        y = draw_wrapped(str(descr), f_txt, x + sw_w + 14, y + LH[f_key] + 6,
                          max_w - (sw_w + 14), COLS["TEXT"]) + 12
 
     # Crop finale alla height usata
@@ -534,6 +643,44 @@ def _render_legend_banner_png(
     return png_path
 
 
+# Da incrementare quando cambia il layout del banner (invalida la cache PNG)
+_BANNER_LAYOUT_VERSION = 1
+
+
+def _legend_banner_png_cached(
+    legend_df: pd.DataFrame,
+    png_path: Path,
+    *,
+    width: int = 1500,
+    margin: int = 60,
+) -> Path:
+    """
+    Come _render_legend_banner_png, ma con cache su disco per contenuto: il PNG è salvato in
+    `<cartella di png_path>/.legend_cache/<hash>.png` (hash di legend_df + parametri di layout)
+    e, se già presente, viene solo copiato su `png_path` senza ridisegnarlo.
+    """
+    import hashlib
+    import shutil
+
+    key = hashlib.sha256(
+        legend_df.to_csv(index=False).encode("utf-8")
+        + f"|w={int(width)}|m={int(margin)}|v={_BANNER_LAYOUT_VERSION}".encode("utf-8")
+    ).hexdigest()[:16]
+    cached = png_path.parent / ".legend_cache" / f"{key}.png"
+    png_path.parent.mkdir(parents=True, exist_ok=True)
+    if cached.is_file():
+        shutil.copyfile(cached, png_path)
+        return png_path
+
+    _render_legend_banner_png(legend_df, png_path, width=width, margin=margin)
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(png_path, cached)
+    except OSError as e:  # cache best-effort
+        LOGGER.warning("Cache banner non scritta (%s): %s", cached, e)
+    return png_path
+
+
 def _embed_banner_on_legend(
     excel_path: Path | str,
     png_path: Path,
@@ -561,51 +708,7 @@ def _embed_banner_on_legend(
 
 
 # ──────────────────────────────────────────────────────────────────────────────
-# Riordino fogli post-scrittura (robusto)
-# ──────────────────────────────────────────────────────────────────────────────
-def _reorder_excel_sheets_robust(excel_path: Path | str, desired_decks: list[str]) -> None:
-    """Riordina i fogli secondo desired_decks; preserva 00_Legenda e 01_Summary in testa."""
-    from openpyxl import load_workbook
-
-    p = Path(excel_path)
-    wb = load_workbook(p)
-    existing_titles = [ws.title for ws in wb.worksheets]
-    title2ws = {ws.title: ws for ws in wb.worksheets}
-
-    def sanitize(s: str) -> str:
-        return _sanitize_sheet_name(s)
-
-    used = set()
-    mapped_titles: list[str] = []
-
-    for fixed in ("00_Legenda", "01_Summary"):
-        if fixed in title2ws:
-            mapped_titles.append(fixed); used.add(fixed)
-
-    desired_san = [sanitize(d) for d in desired_decks]
-    for d in desired_san:
-        exact = [t for t in existing_titles if t == d and t not in used]
-        if exact:
-            mapped_titles.append(exact[0]); used.add(exact[0]); continue
-        starts = [t for t in existing_titles if t.startswith(d) and t not in used]
-        if starts:
-            mapped_titles.append(starts[0]); used.add(starts[0]); continue
-        lower = d.lower()
-        contains = [t for t in existing_titles if (lower in t.lower()) and t not in used]
-        if contains:
-            mapped_titles.append(contains[0]); used.add(contains[0]); continue
-        LOGGER.warning("Reorder: nessun foglio trovato per '%s' (sanificato).", d)
-
-    for t in existing_titles:
-        if t not in mapped_titles:
-            mapped_titles.append(t)
-
-    wb._sheets = [title2ws[t] for t in mapped_titles]  # openpyxl: riordino
-    wb.save(p)
-
-
-# ──────────────────────────────────────────────────────────────────────────────
-# End-to-end: scrive l'Excel, inserisce il banner, riordina i fogli
+# End-to-end: scrive l'Excel (fogli già in ordine di ranking) e inserisce il banner
 # ──────────────────────────────────────────────────────────────────────────────
 def write_pairs_by_deck_report(
     *,
@@ -625,10 +728,13 @@ def write_pairs_by_deck_report(
     include_mas_contrib_col: bool = False,
     out_dir: Path | str = "outputs/RankingData/MARS/Report",
     base_name: Optional[str] = None,   # default: pairs_by_deck_T{T}_MARS
+    table_formats: Iterable[str] = (), # es. ("parquet",) / ("csv",): copie per foglio accanto all'Excel
 ) -> Tuple[Path, Path, Dict]:
     """
     Genera i fogli per-deck, aggiunge 00_Legenda (solo banner) + 01_Summary,
-    scrive l'Excel (versioned + latest), EMBED banner, RIORDINA fogli per ranking.
+    scrive l'Excel (versioned + latest) con i fogli già nell'ordine del ranking, EMBED banner.
+    Con `table_formats` scrive anche un file per foglio (00_Legenda = legenda testuale) in
+    `<out_dir>/<base_name>_tables/`, sovrascritto a ogni run; i path finiscono in meta["tables"].
     """
     # Ordine del ranking (top→bottom)
     if not {"Deck", "Score_%"} <= set(ranking_df.columns):
@@ -656,10 +762,12 @@ def write_pairs_by_deck_report(
     )
 
     # Summary
-    summary_df = build_summary_sheet(ranking_df)
+    summary_df = build_summary_sheet(ranking_df, order=ranking_order)
 
-    # Workbook (sheet '00_Legenda' vuoto: poi embed PNG)
-    workbook = prepare_workbook(sheets_by_deck, legend_df, summary_df, include_legend_table=False)
+    # Workbook (sheet '00_Legenda' vuoto: poi embed PNG); fogli deck nell'ordine del ranking,
+    # così non serve riaprire e risalvare i file per riordinarli
+    workbook = prepare_workbook(sheets_by_deck, legend_df, summary_df, include_legend_table=False,
+                                deck_order=ranking_order)
 
     # Naming & scrittura
     T = meta.get("T", len(sheets_by_deck))
@@ -667,7 +775,10 @@ def write_pairs_by_deck_report(
     if base_name is None:
         base_name = f"pairs_by_deck_T{T}_MARS"
 
-    # Writer robusto
+    # Banner della legenda: serve già al writer, che lo inserisce in 00_Legenda in scrittura
+    banner_png = _legend_banner_png_cached(legend_df, out_dir / "legend_latest.png")
+
+    # Writer robusto: un solo passaggio (dati + styling + banner); il latest è una copia del versionato
     res = None
     try:
         res = write_excel_versioned_styled(
@@ -678,32 +789,34 @@ def write_pairs_by_deck_report(
             include_latest=True,
             also_versioned=True,
             top_k_contrib=5,
+            banner_png=banner_png,
+            banner_sheet="00_Legenda",
         )
     except TypeError as e:
         LOGGER.warning("write_excel_versioned_styled signature mismatch: %s — userò fallback base.", e)
 
     if not (isinstance(res, tuple) and len(res) == 2):
+        # fallback senza styling: banner inserito a posteriori sul versionato, poi copia
         from utils.io import write_excel_versioned
-        versioned_path, latest_path = write_excel_versioned(
+        versioned_path, _ = write_excel_versioned(
             workbook=workbook,
             base_dir=out_dir,
             prefix=base_name,
             tag=None,
-            include_latest=True,
+            include_latest=False,
             also_versioned=True,
         )
+        _embed_banner_on_legend(versioned_path, banner_png, sheet_name="00_Legenda", rows_padding=36)
+        latest_path = copy_file_atomic(versioned_path, out_dir / f"{base_name}_latest.xlsx")
     else:
         versioned_path, latest_path = res
 
-    # Banner su 00_Legenda
-    banner_png = _render_legend_banner_png(legend_df, out_dir / "legend_latest.png")
-    for p in (versioned_path, latest_path):
-        if p:
-            _embed_banner_on_legend(p, banner_png, sheet_name="00_Legenda", rows_padding=36)
-
-    # Riordino fogli secondo ranking
-    _reorder_excel_sheets_robust(versioned_path, ranking_order)
-    _reorder_excel_sheets_robust(latest_path, ranking_order)
+    # Copie per foglio (CSV/Parquet) per consumatori programmatici
+    table_formats = tuple(table_formats)
+    if table_formats:
+        tables = dict(workbook)
+        tables["00_Legenda"] = legend_df
+        meta["tables"] = write_workbook_tables(tables, out_dir / f"{base_name}_tables", formats=table_formats)
 
-    LOGGER.info("Report scritto e riordinato | versioned=%s | latest=%s", versioned_path, latest_path)
+    LOGGER.info("Report scritto | versioned=%s | latest=%s", versioned_path, latest_path)
     return Path(versioned_path), Path(latest_path), meta
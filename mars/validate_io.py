@@ -2,6 +2,14 @@ from __future__ import annotations
 import numpy as np
 import pandas as pd
 
+def _square_float(df: pd.DataFrame) -> np.ndarray | None:
+    """Valori numerici di una matrice con index == columns (stesso ordine), altrimenti None.
+    In quel caso df.T è allineato per posizione e le somme con la trasposta si fanno su ndarray."""
+    if not df.index.equals(df.columns):
+        return None
+    vals = df.to_numpy()
+    return vals if vals.dtype.kind in "fiu" else None
+
 def validate_contract(filtered_wr: pd.DataFrame, n_dir: pd.DataFrame) -> dict:
     """
     Controlli contratto: shape/assi identici, diag=NaN, WR(A,B)+WR(B,A)≈100, n_dir simmetrica.
@@ -12,14 +20,28 @@ def validate_contract(filtered_wr: pd.DataFrame, n_dir: pd.DataFrame) -> dict:
         ok = False; issues.append("shape mismatch")
     if not filtered_wr.index.equals(n_dir.index) or not filtered_wr.columns.equals(n_dir.columns):
         ok = False; issues.append("axis mismatch")
-    if not np.all(np.isnan(np.diag(filtered_wr.values))):
+    # ndarray una volta sola per matrice (asse quadrato); altrimenti aritmetica pandas con allineamento
+    wr = _square_float(filtered_wr)
+    nd = _square_float(n_dir)
+    if not np.all(np.isnan(np.diag(filtered_wr.values if wr is None else wr))):
         ok = False; issues.append("filtered_wr diag not NaN")
-    if not np.all(np.isnan(np.diag(n_dir.values))):
+    if not np.all(np.isnan(np.diag(n_dir.values if nd is None else nd))):
         ok = False; issues.append("n_dir diag not NaN")
-    wr_sum = (filtered_wr + filtered_wr.T).to_numpy()
+    if wr is None:
+        wr_sum = (filtered_wr + filtered_wr.T).to_numpy()
+    else:
+        # la somma è simmetrica: basta il triangolo superiore (diag inclusa, come il controllo pieno)
+        iu = np.triu_indices(wr.shape[0])
+        wr_sum = wr[iu] + wr.T[iu]
     m = ~np.isnan(wr_sum)
-    if m.any() and (np.abs(wr_sum[m] - 100.0) > 1.0).sum() > 0:
+    if m.any() and (np.abs(wr_sum[m] - 100.0) > 1.0).any():
         issues.append("WR symmetry off >1.0pp")
-    if (n_dir.fillna(0.0) - n_dir.T.fillna(0.0)).to_numpy().any():
+    if nd is None:
+        nd_diff = (n_dir.fillna(0.0) - n_dir.T.fillna(0.0)).to_numpy()
+    else:
+        nd0 = np.where(np.isnan(nd), 0.0, nd)
+        with np.errstate(invalid="ignore"):  # inf-inf → NaN (≠0) come in pandas, senza warning
+            nd_diff = nd0 - nd0.T
+    if nd_diff.any():
         issues.append("n_dir not symmetric")
     return {"ok": ok and len([e for e in issues if "mismatch" in e]) == 0, "issues": issues}
@@ -1,15 +1,18 @@
 
 # ──────────────────────────────────────────────────────────────────────────────
-# scraper/decklist.py — Selenium scrape + mini cache of HTML + top-meta filter
+# scraper/decklist.py — HTTP/Selenium scrape + mini cache of HTML + top-meta filter
 # ──────────────────────────────────────────────────────────────────────────────
 
 from __future__ import annotations
-from bs4 import BeautifulSoup
 import re
+from contextlib import ExitStack
 from pathlib import Path
 import hashlib
+import numpy as np
 import pandas as pd
-from scraper.session import cache_is_fresh
+import requests
+from scraper.session import cache_is_fresh, fetch_html
+from scraper.html_tree import parse_html, text_of
 from scraper.browser import chrome, safe_get, polite_sleep
 
 import logging
@@ -19,38 +22,84 @@ netlog = logging.getLogger("ptcgp.net")  # 👈
 LIMITLESS_BASE_URL = "https://play.limitlesstcg.com"
 LIMITLESS_DECKS_URL = f"{LIMITLESS_BASE_URL}/decks?game=POCKET"
 
+# la pagina Decks è HTML statico: se la risposta non ha una tabella si ripiega su Selenium
+_RE_TABLE_TAG = re.compile(r"<table[\s>]", re.IGNORECASE)
+
 
 def _decklist_cache_file(cache_dir: Path, url: str) -> Path:
     h = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
     return cache_dir / f"decks_{h}.html"
 
 
-def scrape_decklist_html(url: str, *, cache_dir: Path, ttl_minutes: int, force_refresh: bool, headless: bool, wait_css_selector: str = "table") -> tuple[str, bool]:
+def _selenium_page_source(driver, url: str, *, wait_css_selector: str, settle_seconds: float) -> str:
+    safe_get(driver, url, wait_css_selector=wait_css_selector, timeout=20)
+    # la pausa non fa da rate limit: lascia solo assestare il rendering dopo il selettore
+    if settle_seconds > 0:
+        polite_sleep(settle_seconds)
+    return driver.page_source
+
+
+def scrape_decklist_html(url: str, *, cache_dir: Path, ttl_minutes: int, force_refresh: bool, headless: bool, wait_css_selector: str = "table", settle_seconds: float = 0.5, driver=None) -> tuple[str, bool]:
+    """HTML della pagina (cache o Selenium) + flag cache hit.
+    Con `driver` riusa un Chrome già aperto; altrimenti ne apre e chiude uno solo per questa pagina.
+    """
     p = _decklist_cache_file(cache_dir, url)
     if not force_refresh and cache_is_fresh(p, ttl_minutes=ttl_minutes):
         netlog.debug("[cache hit] %s", url)  # 👈 invece di log.info(...)
         return p.read_text(encoding="utf-8", errors="ignore"), True
-    # Selenium fetch
-    with chrome(headless=headless) as driver:
-        safe_get(driver, url, wait_css_selector=wait_css_selector, timeout=20)
-        polite_sleep(5.0)
-        html = driver.page_source
+    # Selenium fetch (solo sui miss)
+    if driver is None:
+        with chrome(headless=headless) as drv:
+            html = _selenium_page_source(drv, url, wait_css_selector=wait_css_selector, settle_seconds=settle_seconds)
+    else:
+        html = _selenium_page_source(driver, url, wait_css_selector=wait_css_selector, settle_seconds=settle_seconds)
     p.write_text(html, encoding="utf-8")
     return html, False
 
 
+def scrape_decklists_html(urls: list[str], *, cache_dir: Path, ttl_minutes: int, force_refresh: bool, headless: bool, wait_css_selector: str = "table", settle_seconds: float = 0.5) -> list[tuple[str, bool]]:
+    """scrape_decklist_html su più URL con un solo Chrome, aperto al primo miss e chiuso alla fine."""
+    out: list[tuple[str, bool]] = []
+    with ExitStack() as stack:
+        driver = None
+        for url in urls:
+            p = _decklist_cache_file(cache_dir, url)
+            if driver is None and (force_refresh or not cache_is_fresh(p, ttl_minutes=ttl_minutes)):
+                driver = stack.enter_context(chrome(headless=headless))
+            out.append(scrape_decklist_html(url, cache_dir=cache_dir, ttl_minutes=ttl_minutes, force_refresh=force_refresh,
+                                            headless=headless, wait_css_selector=wait_css_selector,
+                                            settle_seconds=settle_seconds, driver=driver))
+    return out
+
+
+def fetch_decklist_html(url: str, *, session: requests.Session, cache_dir: Path, ttl_minutes: int, force_refresh: bool, rate_limit_seconds: float, headless: bool = True, wait_css_selector: str = "table") -> tuple[str, bool]:
+    """Pagina Decks via requests + cache HTTP (fetch_html); Selenium (scrape_decklist_html) solo
+    se la GET fallisce o la risposta non contiene una <table>.
+    """
+    try:
+        html, from_cache = fetch_html(url, session=session, cache_dir=cache_dir, ttl_minutes=ttl_minutes,
+                                      force_refresh=force_refresh, rate_limit_seconds=rate_limit_seconds)
+    except requests.RequestException as e:
+        log.warning("Decklist via HTTP fallita (%s): ripiego su Selenium", e)
+    else:
+        if _RE_TABLE_TAG.search(html):
+            return html, from_cache
+        log.warning("Decklist via HTTP senza <table>: ripiego su Selenium")
+    return scrape_decklist_html(url, cache_dir=cache_dir, ttl_minutes=ttl_minutes, force_refresh=force_refresh,
+                                headless=headless, wait_css_selector=wait_css_selector)
+
+
 def parse_decklist_table(html: str) -> pd.DataFrame:
-    from bs4 import BeautifulSoup
     import pandas as pd
 
-    soup = BeautifulSoup(html, "lxml")
-    tables = soup.find_all("table")
+    root = parse_html(html)
+    tables = root.xpath("//table") if root is not None else []
     if not tables:
         raise RuntimeError("Nessuna tabella trovata nella pagina Decks")
 
     # scegli la tabella che ha un header con 'Deck'
     def _heads(t):
-        return [th.get_text(" ", strip=True) for th in t.find_all("th")]
+        return [text_of(th) for th in t.iter("th")]
 
     table = None
     for t in tables:
@@ -62,25 +111,25 @@ def parse_decklist_table(html: str) -> pd.DataFrame:
         table = tables[0]
 
     headers = _heads(table)
-    tbody = table.find("tbody")
-    rows = (tbody.find_all("tr") if tbody else table.find_all("tr")[1:]) or []
+    tbody = next(table.iter("tbody"), None)
+    rows = (list(tbody.iter("tr")) if tbody is not None else list(table.iter("tr"))[1:]) or []
 
     data = []
     deck_idx = next((i for i, h in enumerate(headers) if "deck" in (h or "").lower()), None)
 
     from urllib.parse import urljoin
     for tr in rows:
-        tds = tr.find_all("td")
+        tds = list(tr.iter("td"))
         if not tds:
             continue
-        vals = [td.get_text(" ", strip=True) for td in tds]
+        vals = [text_of(td) for td in tds]
 
         # URL della cella 'Deck' (se presente)
         url_cell = None
         if deck_idx is not None and deck_idx < len(tds):
-            a = tds[deck_idx].find("a", href=True)
-            if a:
-                href = a["href"]
+            a = next((x for x in tds[deck_idx].iter("a") if x.get("href") is not None), None)
+            if a is not None:
+                href = a.get("href")
                 url_cell = href if href.startswith("http") else urljoin(LIMITLESS_BASE_URL.rstrip("/") + "/", href.lstrip("/"))
 
         vals.append(url_cell)
@@ -167,17 +216,20 @@ def filter_top_meta(df_decklist: pd.DataFrame, *, threshold_pct: float) -> pd.Da
     def parse_percent_series(s: pd.Series) -> pd.Series:
         return pd.to_numeric(
             s.astype(str)
-             .str.replace("\xa0", "", regex=False)
-             .str.replace("%", "", regex=False)
+             .str.replace(r"[\xa0%]", "", regex=True)
              .str.replace(",", ".", regex=False)
              .str.strip(),
             errors="coerce"
         )
-    df = df_decklist.copy().reset_index()
-    df["share"] = parse_percent_series(df["Share"]).fillna(0.0)
-    df = df.sort_values("share", ascending=False, kind="mergesort").reset_index(drop=True)
-    df["share_cum"] = df["share"].cumsum()
-    pos = (df["share_cum"] >= float(threshold_pct)).idxmax() if (df["share_cum"] >= float(threshold_pct)).any() else len(df)-1
-    top = df.iloc[:pos+1].copy()
+    shares = parse_percent_series(df_decklist["Share"]).fillna(0.0).to_numpy()
+    # ordinamento decrescente stabile (= sort_values mergesort) e cumulata in NumPy
+    order = np.argsort(-shares, kind="stable")
+    cum = shares[order].cumsum()
+    # primo indice con cumulata ≥ soglia (la cumulata non è monotona se ci sono share negative,
+    # quindi maschera + argmax e non searchsorted); se mai raggiunta si tiene tutto
+    hit = cum >= float(threshold_pct)
+    pos = int(hit.argmax()) if hit.any() else len(cum) - 1
+    top = df_decklist.reset_index().iloc[order[:pos + 1]].reset_index(drop=True)
+    top["share"] = shares[order[:pos + 1]]
+    top["share_cum"] = cum[:pos + 1]
     return top
-
@@ -0,0 +1,44 @@
+
+# ──────────────────────────────────────────────────────────────────────────────
+# scraper/html_tree.py — parsing HTML con lxml (albero nativo, niente wrapper bs4)
+# ──────────────────────────────────────────────────────────────────────────────
+
+from __future__ import annotations
+import lxml.etree
+import lxml.html
+
+# testo ignorato come in bs4.get_text (stringhe di script/style/template non sono "testo")
+_NO_TEXT_TAGS = ("script", "style", "template")
+
+
+def parse_html(html: str):
+    """Radice lxml (<html>) della pagina; None se la pagina è vuota/non parsabile."""
+    if not html or not html.strip():
+        return None
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # str con dichiarazione di encoding XML: lxml vuole bytes
+        return lxml.html.document_fromstring(html.encode("utf-8"))
+    except lxml.etree.ParserError:
+        return None
+
+
+def text_of(el) -> str:
+    """Come bs4 `get_text(" ", strip=True)`: frammenti di testo ripuliti, non vuoti, uniti da spazio."""
+    if next(el.iter(*_NO_TEXT_TAGS), None) is None:
+        chunks = el.itertext()
+    else:
+        chunks = _iter_text(el)
+    return " ".join(s for s in (c.strip() for c in chunks) if s)
+
+
+def _iter_text(el):
+    """itertext che salta il contenuto di script/style/template (i commenti li salta già lxml)."""
+    if el.text:
+        yield el.text
+    for ch in el:
+        if isinstance(ch.tag, str) and ch.tag not in _NO_TEXT_TAGS:
+            yield from _iter_text(ch)
+        if ch.tail:
+            yield ch.tail
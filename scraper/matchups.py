@@ -4,8 +4,9 @@
 # ──────────────────────────────────────────────────────────────────────────────
 
 from __future__ import annotations
-from bs4 import BeautifulSoup
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import pandas as pd
 import requests  # solo per l'annotation requests.Session
@@ -13,8 +14,15 @@ import logging
 log = logging.getLogger("ptcgp")
 
 from scraper.session import fetch_html
+from scraper.html_tree import parse_html, text_of
 from scraper.decklist import LIMITLESS_BASE_URL
 
+# pattern delle celle matchup, compilati una volta (il loop righe gira N_righe × N_deck volte)
+_DASH = r"[\-–—−]"
+_RE_RECORD = re.compile(rf"(\d+)\s*{_DASH}\s*(\d+)(?:\s*{_DASH}\s*(\d+))?")
+_RE_DIGITS = re.compile(r"\d+")
+_RE_WR = re.compile(r"(\d+(?:\.\d+)?)")
+
 
 def to_matchup_url(u: str | None) -> str | None:
     if not isinstance(u, str):
@@ -35,11 +43,14 @@ def to_matchup_url(u: str | None) -> str | None:
 
 
 def extract_matchups_from_html(html: str, deck_name: str) -> list[dict]:
-    soup = BeautifulSoup(html, "lxml")
+    root = parse_html(html)
+    if root is None:
+        return []
+    tables = root.xpath("//table")
     # select proper table
-    def _select_table(soup):
-        for t in soup.find_all("table"):
-            heads_raw = [th.get_text(" ", strip=True) for th in t.find_all("th")]
+    def _select_table(tables):
+        for t in tables:
+            heads_raw = [text_of(th) for th in t.iter("th")]
             heads = [h.strip().lower() for h in heads_raw]
             has_deck = any("deck" in h for h in heads)
             has_matches = any("matches" in h for h in heads)
@@ -48,11 +59,13 @@ def extract_matchups_from_html(html: str, deck_name: str) -> list[dict]:
             if has_deck and has_matches and has_score and has_wr:
                 return t
         return None
-    table = _select_table(soup) or soup.find("table")
+    table = _select_table(tables)
+    if table is None:
+        table = tables[0] if tables else None
     if table is None:
         return []
-    thead = table.find("thead")
-    headers_raw = [th.get_text(" ", strip=True) for th in (thead.find_all("th") if thead else table.find_all("th"))]
+    thead = next(table.iter("thead"), None)
+    headers_raw = [text_of(th) for th in (thead if thead is not None else table).iter("th")]
     headers = [h.strip().lower() for h in headers_raw]
     def _idx(check):
         for i, (h, hr) in enumerate(zip(headers, headers_raw)):
@@ -65,28 +78,27 @@ def extract_matchups_from_html(html: str, deck_name: str) -> list[dict]:
     i_wr = _idx(lambda h, hr: ("win" in h and "%" in hr) or ("winrate" in h))
     if None in (i_opp, i_n, i_rec, i_wr):
         return []
-    tbody = table.find("tbody")
-    rows = (tbody.find_all("tr") if tbody else table.find_all("tr")[1:]) or []
+    tbody = next(table.iter("tbody"), None)
+    rows = (list(tbody.iter("tr")) if tbody is not None else list(table.iter("tr"))[1:]) or []
     out: list[dict] = []
-    dash = r"[\-–—−]"
     for row in rows:
-        cols = row.find_all(["td", "th"])
+        cols = list(row.iter("td", "th"))
         if not cols:
             continue
-        a = cols[i_opp].find("a")
-        opp = (a.get_text(" ", strip=True) if a else cols[i_opp].get_text(" ", strip=True)) or "Unknown"
+        a = next(cols[i_opp].iter("a"), None)
+        opp = (text_of(a) if a is not None else text_of(cols[i_opp])) or "Unknown"
         # N
-        digits = re.findall(r"\d+", cols[i_n].get_text(" ", strip=True) or "")
+        digits = _RE_DIGITS.findall(text_of(cols[i_n]) or "")
         n = int("".join(digits)) if digits else 0
         # record W-L(-T)
-        m = re.search(rf"(\d+)\s*{dash}\s*(\d+)(?:\s*{dash}\s*(\d+))?", cols[i_rec].get_text(" ", strip=True) or "")
+        m = _RE_RECORD.search(text_of(cols[i_rec]) or "")
         if not m:
             w=l=t=0
         else:
             w, l, t = int(m.group(1)), int(m.group(2)), int(m.group(3) or 0)
         # WR (optional)
-        wr_txt = cols[i_wr].get_text(" ", strip=True) or ""
-        m2 = re.search(r"(\d+(?:\.\d+)?)", wr_txt.replace(",", "."))
+        wr_txt = text_of(cols[i_wr]) or ""
+        m2 = _RE_WR.search(wr_txt.replace(",", "."))
         wr = float(m2.group(1)) if m2 else None
         # N consistency
         n_calc = w + l + t
@@ -114,10 +126,12 @@ def scrape_matchups(
     rate_limit_seconds: float = 5.0,
     progress: bool = False,                 # barra di progressione
     pbar_desc: str = "Scraping matchups",   # descrizione barra
+    max_workers: int = 8,                   # fetch+parse in parallelo (rate limit condiviso sulla session)
 ) -> tuple[pd.DataFrame, int, int]:
     """
     urls: list of (deck_name, matchup_url)
     Returns: (df_raw, total_pages, cache_hits)
+    Le righe restano nell'ordine degli URL, qualunque sia l'ordine di completamento.
     """
 
     # --- deduplica URL mantenendo il primo deck_name visto ---
@@ -131,23 +145,13 @@ def scrape_matchups(
         dedup.append((deck_name, u))
 
     total = len(dedup)
-    rows: list[dict] = []
     cache_hits = 0
+    n_rows = 0
+    parts: list[list[dict]] = [[] for _ in dedup]
+    # un solo "adesso" per il controllo TTL di tutta la corsa
+    now_ts = time.time()
 
-    # --- iteratore con tqdm se richiesto ---
-    use_pbar = False
-    iterator = dedup
-    if progress:
-        try:
-            from tqdm.auto import tqdm  # lazy import per non aggiungere dipendenze a runtime se non serve
-            iterator = tqdm(dedup, total=total, desc=pbar_desc, leave=False, dynamic_ncols=True)
-            use_pbar = True
-        except Exception:
-            use_pbar = False
-            iterator = dedup
-
-    # --- loop fetch + parse ---
-    for deck_name, u in iterator:
+    def _fetch_parse(deck_name: str, u: str) -> tuple[list[dict], bool]:
         html, from_cache = fetch_html(
             u,
             session=session,
@@ -155,16 +159,45 @@ def scrape_matchups(
             ttl_minutes=ttl_minutes,
             force_refresh=force_refresh,
             rate_limit_seconds=rate_limit_seconds,
+            now_ts=now_ts,
         )
-        cache_hits += int(from_cache)
-        rows.extend(extract_matchups_from_html(html, deck_name))
+        return extract_matchups_from_html(html, deck_name), from_cache
 
-        # aggiornamento veloce della progress bar
-        if use_pbar:
+    # --- fetch + parse nel pool; i risultati si raccolgono solo qui (niente lock) ---
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as ex:
+        futs = {ex.submit(_fetch_parse, deck_name, u): i for i, (deck_name, u) in enumerate(dedup)}
+
+        # --- iteratore con tqdm se richiesto ---
+        use_pbar = False
+        iterator = as_completed(futs)
+        if progress:
             try:
-                iterator.set_postfix({"cache": cache_hits, "rows": len(rows)}, refresh=False)
+                from tqdm.auto import tqdm  # lazy import per non aggiungere dipendenze a runtime se non serve
+                iterator = tqdm(iterator, total=total, desc=pbar_desc, leave=False, dynamic_ncols=True)
+                use_pbar = True
             except Exception:
-                pass
+                use_pbar = False
+
+        try:
+            for fut in iterator:
+                part, from_cache = fut.result()
+                parts[futs[fut]] = part
+                cache_hits += int(from_cache)
+                n_rows += len(part)
+
+                # aggiornamento veloce della progress bar
+                if use_pbar:
+                    try:
+                        iterator.set_postfix({"cache": cache_hits, "rows": n_rows}, refresh=False)
+                    except Exception:
+                        pass
+        except BaseException:
+            # errore su un URL: non aspettare le pagine ancora in coda
+            for f in futs:
+                f.cancel()
+            raise
+
+    rows = [r for part in parts for r in part]
 
     # --- build DataFrame + tipi coerenti ---
     df = pd.DataFrame(rows)
@@ -5,11 +5,12 @@ from __future__ import annotations
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from datetime import datetime, timedelta
 from pathlib import Path
+import os
 import time
 import hashlib
 import logging
+import threading
 
 log    = logging.getLogger("ptcgp")
 netlog = logging.getLogger("ptcgp.net")  # 👈 logger dedicato solo al traffico rete/cache
@@ -39,32 +40,67 @@ def make_session(user_agent: str = DEFAULT_UA, *, max_retries: int = 3, backoff:
         "Connection": "keep-alive",
     })
     s.request_timeout = timeout  # attach for external usage
+    s.rate_limiter = _RateLimiter()  # spaziatura richieste condivisa tra i worker
     return s
 
+
+class _RateLimiter:
+    """Intervallo minimo tra l'avvio di due richieste di rete, condiviso tra thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self, interval: float) -> None:
+        # prenota lo slot sotto lock, dorme fuori: i worker successivi si accodano in ordine
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + max(float(interval), 0.0)
+        if start > now:
+            time.sleep(start - now)
+
+
+_LIMITER_LOCK = threading.Lock()
+
+def _session_limiter(session: requests.Session) -> _RateLimiter:
+    # sessioni non create da make_session: limiter agganciato alla prima richiesta
+    lim = getattr(session, "rate_limiter", None)
+    if lim is None:
+        with _LIMITER_LOCK:
+            lim = getattr(session, "rate_limiter", None)
+            if lim is None:
+                lim = session.rate_limiter = _RateLimiter()
+    return lim
+
 def _cache_file(cache_dir: Path, url: str) -> Path:
     h = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
     return cache_dir / f"{h}.html"
 
-def cache_is_fresh(path: Path, *, ttl_minutes: int) -> bool:
+def cache_is_fresh(path: Path, *, ttl_minutes: int, now_ts: float | None = None) -> bool:
+    # un solo stat (file mancante = OSError); now_ts lo passa chi controlla molti file in un colpo
     try:
-        if ttl_minutes <= 0 or not path.exists():
+        if ttl_minutes <= 0:
             return False
-        mtime = datetime.fromtimestamp(path.stat().st_mtime)
-        return (datetime.now() - mtime) < timedelta(minutes=ttl_minutes)
+        mtime = os.stat(path).st_mtime
     except Exception:
         return False
+    if now_ts is None:
+        now_ts = time.time()
+    return (now_ts - mtime) < ttl_minutes * 60.0
 
 def fetch_html(url: str, *, session: requests.Session, cache_dir: Path, ttl_minutes: int,
-               force_refresh: bool, rate_limit_seconds: float) -> tuple[str, bool]:
+               force_refresh: bool, rate_limit_seconds: float, now_ts: float | None = None) -> tuple[str, bool]:
     cache_dir.mkdir(parents=True, exist_ok=True)
     p = _cache_file(cache_dir, url)
-    if not force_refresh and cache_is_fresh(p, ttl_minutes=ttl_minutes):
+    if not force_refresh and cache_is_fresh(p, ttl_minutes=ttl_minutes, now_ts=now_ts):
         netlog.debug("[cache hit] %s", url)   # 👈 niente INFO
         return p.read_text(encoding="utf-8", errors="ignore"), True
 
+    # rate limit solo sui miss: attende il proprio turno prima della GET
+    _session_limiter(session).wait(rate_limit_seconds)
     netlog.debug("[fetch] %s", url)          # 👈 niente INFO
     resp = session.get(url, timeout=getattr(session, "request_timeout", 20))
-    time.sleep(rate_limit_seconds)
     resp.raise_for_status()
     html = resp.text
     try:
@@ -196,6 +196,60 @@ def save_plot_dual(fig, base_dir: Path | str, prefix: str, tag: str, *, fmt: str
     return ts_path, latest_path
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Sostituzione atomica con retry (file lockati su Windows/OneDrive)
+# ──────────────────────────────────────────────────────────────────────────────
+
+def _replace_with_retry(tmp: Path, path: Path, *, retries: int = 6, backoff_s: float = 0.7) -> Path:
+    """
+    os.replace(tmp -> path) con retry su PermissionError; se il lock persiste salva come
+    fallback '*_LOCKED_YYYYmmdd_HHMMSS<suffix>'. Ritorna il path effettivamente scritto.
+    """
+    import os
+
+    last_exc: Exception | None = None
+    for i in range(max(1, retries)):
+        try:
+            os.replace(tmp, path)  # atomic on Windows too
+            return path
+        except PermissionError as e:
+            last_exc = e
+            time.sleep(backoff_s * (1.8 ** i))
+
+    # fallback name se lock persiste
+    fallback = path.with_name(f"{path.stem}_LOCKED_{datetime.now().strftime('%Y%m%d_%H%M%S')}{path.suffix}")
+    try:
+        os.replace(tmp, fallback)
+    except Exception:
+        # extrema ratio: copia e rimuovi il tmp
+        import shutil
+        shutil.copy2(tmp, fallback)
+        tmp.unlink(missing_ok=True)
+    log.warning("scrittura atomica: target lockato: %s → salvato come fallback: %s", path, fallback)
+    return fallback
+
+
+def copy_file_atomic(src: Path | str, dst: Path | str, *, retries: int = 6, backoff_s: float = 0.7) -> Path:
+    """
+    Copia `src` su `dst` passando da un tmp nella cartella di destinazione + os.replace
+    (stesse garanzie di lock/fallback della scrittura Excel). Ritorna il path scritto.
+    """
+    import os
+    import shutil
+    import tempfile
+
+    src, dst = Path(src), Path(dst)
+    fd, tmp_name = tempfile.mkstemp(dir=dst.parent, prefix=dst.stem + "_", suffix=".tmp" + dst.suffix)
+    os.close(fd)
+    tmp = Path(tmp_name)
+    try:
+        shutil.copyfile(src, tmp)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    return _replace_with_retry(tmp, dst, retries=retries, backoff_s=backoff_s)
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Excel writer (base)
 # ──────────────────────────────────────────────────────────────────────────────
@@ -251,10 +305,209 @@ def write_excel_versioned(
     return ts_path, latest_path
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Tabelle per foglio (CSV / Parquet) per consumatori programmatici
+# ──────────────────────────────────────────────────────────────────────────────
+
+def write_workbook_tables(
+    workbook: dict[str, pd.DataFrame],
+    dest_dir: Path | str,
+    *,
+    formats: Iterable[str] = ("parquet",),
+    parquet_compression: str = "zstd",
+) -> list[Path]:
+    """
+    Scrive ogni foglio del workbook come file a sé in `dest_dir` (<sheet>.csv / <sheet>.parquet),
+    sovrascrivendo la copia precedente. Molto più rapido dell'XLSX (niente ZIP/XML) e
+    pensato per pipeline a valle; l'Excel resta l'output per la lettura umana.
+    Parquet richiede pyarrow o fastparquet: se assenti, il formato viene saltato con warning.
+    Ritorna i path scritti.
+    """
+    dest = Path(dest_dir)
+    dest.mkdir(parents=True, exist_ok=True)
+    fmts = [str(f).lower() for f in formats]
+    unknown = sorted(set(fmts) - {"csv", "parquet"})
+    if unknown:
+        raise ValueError(f"formati tabelle non supportati: {unknown}")
+
+    written: list[Path] = []
+    for fmt in dict.fromkeys(fmts):
+        for sheet_name, df in workbook.items():
+            path = dest / f"{sheet_name}.{fmt}"
+            if fmt == "csv":
+                df.to_csv(path, index=False, encoding="utf-8")
+            else:
+                try:
+                    df.to_parquet(path, index=False, compression=parquet_compression)
+                except ImportError as e:
+                    log.warning("Parquet non disponibile (%s): tabelle .parquet saltate.", e)
+                    break
+            written.append(path)
+    log.info("Tabelle per foglio scritte: %d file in %s", len(written), dest)
+    return written
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Excel writer con styling (semafori gap, Top-K, Mirror, legenda colori)
 # ──────────────────────────────────────────────────────────────────────────────
 
+# Colori (ARGB) condivisi da semafori, Top-K, Mirror e swatch della legenda
+_XL_COLORS = {
+    "RED":    "FFF2CBCB",  # rosso chiaro
+    "YELLOW": "FFFFF2CC",  # giallo chiaro
+    "GREEN":  "FFD9EAD3",  # verde chiaro
+    "GRAY":   "FFCDCDCD",  # grigio #CDCDCD
+}
+
+
+def _excel_column_values(s: pd.Series, *, coerce_str_numbers: bool = False) -> list:
+    """
+    Valori Python di una colonna pronti per openpyxl, come li scriveva pandas.to_excel:
+    NaN/NA → cella vuota (None), ±inf → 'inf'/'-inf', interi/float NumPy → int/float Python.
+    `coerce_str_numbers`: stringhe numeriche ("1,5") convertite in float (colonna gap_pp).
+    """
+    vals = s.to_numpy(dtype=object, na_value=None).tolist()
+    if pd.api.types.is_float_dtype(s.dtype):
+        vals = [("inf" if v > 0 else "-inf") if v is not None and v in (float("inf"), float("-inf")) else v
+                for v in vals]
+    if coerce_str_numbers:
+        out = []
+        for v in vals:
+            if isinstance(v, str):
+                try:
+                    v = float(v.replace(",", "."))
+                except Exception:
+                    pass
+            out.append(v)
+        vals = out
+    return vals
+
+
+def _write_styled_xlsx(
+    path: Path,
+    workbook: dict[str, pd.DataFrame],
+    *,
+    top_k_contrib: int = 5,
+    banner_png: Path | str | None = None,
+    banner_sheet: str = "00_Legenda",
+) -> None:
+    """
+    Scrive il workbook in un solo passaggio con openpyxl write_only: righe in streaming
+    (ws.append) con lo stile già applicato cella per cella, regole CF e banner inclusi.
+    Niente rilettura/risalvataggio del file per lo styling o per l'immagine.
+
+    Stili equivalenti a pandas.to_excel + styling: header grassetto con bordo sottile
+    (centrato, in alto), semafori gap_pp, Top-K MAS_contrib_pp, riga 'Mirror' grigia con
+    Opponent in corsivo, swatch nella colonna 'Colore' di 00_Legenda.
+    Se `banner_png` è dato, `banner_sheet` contiene solo l'immagine in A1.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+    from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+    from openpyxl.styles.colors import Color
+    from openpyxl.formatting.rule import CellIsRule, Rule
+    from openpyxl.styles.differential import DifferentialStyle
+
+    fills = {k: PatternFill(start_color=v, end_color=v, fill_type="solid") for k, v in _XL_COLORS.items()}
+    thin = Side(style="thin")
+    header_font = Font(name="Calibri", sz=11, b=True, color=Color(theme=1), family=2, scheme="minor")
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_align = Alignment(horizontal="center", vertical="top")
+    mirror_font = Font(name="Calibri", sz=11, i=True, color=Color(theme=1))
+    wrap_top = Alignment(wrap_text=True, vertical="top", horizontal="left")
+
+    wb = Workbook(write_only=True)
+    for name, df in workbook.items():
+        ws = wb.create_sheet(title=name)
+
+        if banner_png is not None and name == banner_sheet:
+            from openpyxl.drawing.image import Image as XLImage
+            ws.add_image(XLImage(str(banner_png)), "A1")
+            continue
+
+        columns = list(df.columns)
+        if not columns:
+            continue
+        headers = {c: j for j, c in enumerate(columns) if isinstance(c, str)}
+        n_rows = len(df)
+        is_legend = name == "00_Legenda"
+        is_deck = name not in ("00_Legenda", "01_Summary")
+        styled = n_rows >= 1  # header + almeno una riga
+
+        # Larghezze colonne (vanno fissate prima delle righe)
+        if styled and is_legend:
+            for col_name, width in (("Campo", 26), ("Descrizione", 92), ("Colore", 12)):
+                if col_name in headers:
+                    ws.column_dimensions[get_column_letter(headers[col_name] + 1)].width = width
+
+        wrap_cols = {headers[c] for c in ("Campo", "Descrizione") if c in headers} if (styled and is_legend) else set()
+
+        # Header
+        row = []
+        for j, c in enumerate(columns):
+            cell = WriteOnlyCell(ws, value=c)
+            cell.font = header_font
+            cell.border = header_border
+            cell.alignment = wrap_top if j in wrap_cols else header_align
+            row.append(cell)
+        ws.append(row)
+
+        # Corpo: colonne → liste Python una volta, poi righe per zip
+        cols = [
+            _excel_column_values(df.iloc[:, j], coerce_str_numbers=(styled and not is_legend and c == "gap_pp"))
+            for j, c in enumerate(columns)
+        ]
+        colore_j = headers.get("Colore") if (styled and is_legend) else None
+        opp_j = headers.get("Opponent") if (styled and is_deck) else None
+        plain = not wrap_cols and colore_j is None and opp_j is None
+        for vals in zip(*cols):
+            if plain:
+                ws.append(vals)
+                continue
+            is_mirror = (opp_j is not None and isinstance(vals[opp_j], str)
+                         and vals[opp_j].strip().lower() == "mirror")
+            if not (is_mirror or wrap_cols or colore_j is not None):
+                ws.append(vals)
+                continue
+            row = []
+            for j, v in enumerate(vals):
+                cell = WriteOnlyCell(ws, value=v)
+                if j in wrap_cols:
+                    cell.alignment = wrap_top
+                if j == colore_j and isinstance(v, str) and v.strip().upper() in fills:
+                    cell.fill = fills[v.strip().upper()]
+                    cell.value = ""  # cella come swatch
+                if is_mirror:
+                    cell.fill = fills["GRAY"]
+                    if j == opp_j:
+                        cell.font = mirror_font
+                row.append(cell)
+            ws.append(row)
+
+        if not styled or is_legend:
+            continue
+        last = n_rows + 1
+
+        # Semafori su gap_pp: 4 regole, >= 8, <= -8, [4..8], [-8..-4]
+        if "gap_pp" in headers:
+            L = get_column_letter(headers["gap_pp"] + 1)
+            rng = f"{L}2:{L}{last}"
+            ws.conditional_formatting.add(rng, CellIsRule(operator="greaterThanOrEqual", formula=["8"],   fill=fills["RED"]))
+            ws.conditional_formatting.add(rng, CellIsRule(operator="lessThanOrEqual",    formula=["-8"],  fill=fills["RED"]))
+            ws.conditional_formatting.add(rng, CellIsRule(operator="between",            formula=["4","8"],     fill=fills["YELLOW"]))
+            ws.conditional_formatting.add(rng, CellIsRule(operator="between",            formula=["-8","-4"],  fill=fills["YELLOW"]))
+
+        # Top-K nativo su MAS_contrib_pp (solo fogli per-deck)
+        if "MAS_contrib_pp" in headers and top_k_contrib and is_deck:
+            L = get_column_letter(headers["MAS_contrib_pp"] + 1)
+            dxf = DifferentialStyle(fill=fills["GREEN"])
+            rule = Rule(type="top10", rank=int(top_k_contrib), percent=False, bottom=False, dxf=dxf)
+            ws.conditional_formatting.add(f"{L}2:{L}{last}", rule)
+
+    wb.save(path)
+
+
 def write_excel_versioned_styled(
     workbook: dict[str, pd.DataFrame],
     base_dir: Path | str,
@@ -264,6 +517,8 @@ def write_excel_versioned_styled(
     include_latest: bool = True,
     also_versioned: bool = True,
     top_k_contrib: int = 5,
+    banner_png: Path | str | None = None,
+    banner_sheet: str = "00_Legenda",
 ) -> tuple[Path | None, Path | None]:
     """
     Come write_excel_versioned, ma aggiunge:
@@ -271,7 +526,9 @@ def write_excel_versioned_styled(
       - evidenziazione Top-K su MAS_contrib_pp con Rule(type="top10") nativa
       - colorazione riga 'Mirror' (grigio #CDCDCD) + 'Opponent' in corsivo
       - swatch di colore nella colonna 'Colore' del foglio 00_Legenda
+      - (opzionale) banner PNG in A1 di `banner_sheet`, che contiene solo l'immagine
 
+    Il file è scritto in un solo passaggio (openpyxl write_only, vedi _write_styled_xlsx).
     In più: scrittura ATOMICA con retry/fallback per evitare PermissionError su Windows/OneDrive.
     """
     import os
@@ -288,17 +545,13 @@ def write_excel_versioned_styled(
     ts_path = dest_dir / ts_name if also_versioned else None
     latest_path = dest_dir / latest_name if include_latest else None
 
-    # Preferisci xlsxwriter per la scrittura; fallback a openpyxl se non installato
-    engine = None
-    for eng in ("xlsxwriter", "openpyxl"):
-        try:
-            __import__(eng)
-            engine = eng
-            break
-        except Exception:
-            continue
-    if engine is None:
-        engine = "openpyxl"
+    # openpyxl per scrittura+styling in un passaggio; senza openpyxl: pandas/xlsxwriter, senza styling
+    try:
+        import openpyxl  # noqa: F401
+        styled = True
+    except Exception as e:
+        log.warning("openpyxl non disponibile per styling: %s", e)
+        styled = False
 
     # ------- helper: scrittura atomica con retry -------
     def _atomic_write(path: Path, *, retries: int = 6, backoff_s: float = 0.7) -> Path:
@@ -314,178 +567,31 @@ def write_excel_versioned_styled(
 
         # scrivi sul tmp
         try:
-            with pd.ExcelWriter(tmp, engine=engine) as xw:
-                for sheet_name, df in workbook.items():
-                    df.to_excel(xw, sheet_name=sheet_name, index=False)
+            if styled:
+                _write_styled_xlsx(tmp, workbook, top_k_contrib=top_k_contrib,
+                                   banner_png=banner_png, banner_sheet=banner_sheet)
+            else:
+                with pd.ExcelWriter(tmp, engine="xlsxwriter") as xw:
+                    for sheet_name, df in workbook.items():
+                        df.to_excel(xw, sheet_name=sheet_name, index=False)
         except Exception:
             try:
                 tmp.unlink(missing_ok=True)
             finally:
                 raise
 
-        # replace con retry
-        last_exc: Exception | None = None
-        for i in range(max(1, retries)):
-            try:
-                os.replace(tmp, path)  # atomic on Windows too
-                return path
-            except PermissionError as e:
-                last_exc = e
-                time.sleep(backoff_s * (1.8 ** i))
-
-        # fallback name se lock persiste
-        fallback = path.with_name(f"{path.stem}_LOCKED_{datetime.now().strftime('%Y%m%d_%H%M%S')}{path.suffix}")
-        try:
-            os.replace(tmp, fallback)
-        except Exception:
-            # extrema ratio: copia e rimuovi il tmp
-            import shutil
-            shutil.copy2(tmp, fallback)
-            tmp.unlink(missing_ok=True)
-        log.warning("write_excel_versioned_styled: target lockato: %s → salvato come fallback: %s", path, fallback)
-        return fallback
-
-    # ------- helper: styling in-place con retry -------
-    def _style_in_place(path: Path, *, retries: int = 6, backoff_s: float = 0.7) -> None:
-        """Applica styling in-place con retry su lock; NO-OP se lock persistente o openpyxl assente."""
-        try:
-            from openpyxl import load_workbook
-            from openpyxl.utils import get_column_letter
-            from openpyxl.styles import PatternFill, Font, Alignment
-            from openpyxl.formatting.rule import CellIsRule, Rule
-            from openpyxl.styles.differential import DifferentialStyle
-        except Exception as e:
-            log.warning("openpyxl non disponibile per styling: %s", e)
-            return
-
-        last_exc: Exception | None = None
-        for i in range(max(1, retries)):
-            try:
-                wb = load_workbook(path)
-                for ws in wb.worksheets:
-                    name = ws.title
-
-                    # Header map
-                    headers = {cell.value: idx for idx, cell in enumerate(ws[1], start=1) if isinstance(cell.value, str)}
-                    max_row = ws.max_row
-                    max_col = ws.max_column
-                    if max_row < 2:
-                        continue
-
-                    # ===== Styling specifico per 00_Legenda =====
-                    if name == "00_Legenda":
-                        # Larghezze colonne: Campo / Descrizione / Colore
-                        if "Campo" in headers:
-                            ws.column_dimensions[get_column_letter(headers["Campo"])].width = 26
-                        if "Descrizione" in headers:
-                            ws.column_dimensions[get_column_letter(headers["Descrizione"])].width = 92
-                        if "Colore" in headers:
-                            ws.column_dimensions[get_column_letter(headers["Colore"])].width = 12
-
-                        # Wrap & allineamento verticale in alto su Campo/Descrizione
-                        wrap_top = Alignment(wrap_text=True, vertical="top", horizontal="left")
-                        for col_name in ("Campo", "Descrizione"):
-                            col_idx = headers.get(col_name)
-                            if col_idx is None:
-                                continue
-                            for r in range(1, max_row + 1):
-                                ws.cell(row=r, column=col_idx).alignment = wrap_top
-
-                        # Swatch di colore nella colonna 'Colore'
-                        if "Colore" in headers:
-                            col_c = headers["Colore"]
-                            cmap = {
-                                "RED":   "FFF2CBCB",  # rosso chiaro
-                                "YELLOW":"FFFFF2CC",  # giallo chiaro
-                                "GREEN": "FFD9EAD3",  # verde chiaro
-                                "GRAY":  "FFCDCDCD",  # grigio #CDCDCD
-                            }
-                            for r in range(2, max_row + 1):
-                                key_cell = ws.cell(row=r, column=col_c)
-                                key = key_cell.value
-                                if isinstance(key, str):
-                                    key_norm = key.strip().upper()
-                                    if key_norm in cmap:
-                                        key_cell.fill = PatternFill(
-                                            start_color=cmap[key_norm],
-                                            end_color=cmap[key_norm],
-                                            fill_type="solid",
-                                        )
-                                        key_cell.value = ""  # cella come swatch
-                        # Passa al prossimo foglio
-                        continue
-
-                    # ===== Fogli per-deck / Summary =====
-
-                    # Semafori su gap_pp (robusti con CellIsRule)
-                    if "gap_pp" in headers:
-                        col = headers["gap_pp"]
-                        L = get_column_letter(col)
-                        rng = f"{L}2:{L}{max_row}"
-
-                        red_fill    = PatternFill(start_color="FFF2CBCB", end_color="FFF2CBCB", fill_type="solid")
-                        yellow_fill = PatternFill(start_color="FFFFF2CC", end_color="FFFFF2CC", fill_type="solid")
-
-                        # Coercizione soft: se Excel vede stringhe, prova a convertirle in numeri
-                        for r_ in range(2, max_row + 1):
-                            c = ws.cell(row=r_, column=col)
-                            if isinstance(c.value, str):
-                                try:
-                                    c.value = float(c.value.replace(",", "."))
-                                except Exception:
-                                    pass
-
-                        # 4 regole: >= 8, <= -8, [4..8], [-8..-4]
-                        ws.conditional_formatting.add(rng, CellIsRule(operator="greaterThanOrEqual", formula=["8"],   fill=red_fill))
-                        ws.conditional_formatting.add(rng, CellIsRule(operator="lessThanOrEqual",    formula=["-8"],  fill=red_fill))
-                        ws.conditional_formatting.add(rng, CellIsRule(operator="between",            formula=["4","8"],     fill=yellow_fill))
-                        ws.conditional_formatting.add(rng, CellIsRule(operator="between",            formula=["-8","-4"],  fill=yellow_fill))
-
-                    # Top-K nativo su MAS_contrib_pp (solo fogli per-deck)
-                    if "MAS_contrib_pp" in headers and top_k_contrib and name not in ("00_Legenda", "01_Summary"):
-                        col = headers["MAS_contrib_pp"]
-                        L = get_column_letter(col)
-                        rng = f"{L}2:{L}{max_row}"
-
-                        dxf = DifferentialStyle(fill=PatternFill(start_color="FFD9EAD3",
-                                                                 end_color="FFD9EAD3",
-                                                                 fill_type="solid"))
-                        rule = Rule(type="top10", rank=int(top_k_contrib), percent=False, bottom=False, dxf=dxf)
-                        ws.conditional_formatting.add(rng, rule)
-
-                    # Riga 'Mirror' in grigio su tutta la riga + Opponent in corsivo
-                    opp_col = headers.get("Opponent")
-                    if opp_col is not None and name not in ("00_Legenda", "01_Summary"):
-                        gray = PatternFill(start_color="FFCDCDCD", end_color="FFCDCDCD", fill_type="solid")
-                        for r_ in range(2, max_row + 1):
-                            cell = ws.cell(row=r_, column=opp_col)
-                            if isinstance(cell.value, str) and cell.value.strip().lower() == "mirror":
-                                try:
-                                    cell.font = Font(
-                                        name=cell.font.name, sz=cell.font.sz, bold=cell.font.bold,
-                                        italic=True, vertAlign=cell.font.vertAlign,
-                                        underline=cell.font.underline, color=cell.font.color
-                                    )
-                                except Exception:
-                                    cell.font = cell.font.copy(italic=True)
-                                for c_ in range(1, max_col + 1):
-                                    ws.cell(row=r_, column=c_).fill = gray
-
-                wb.save(path)
-                return
-            except PermissionError as e:
-                last_exc = e
-                time.sleep(backoff_s * (1.8 ** i))
-        log.warning("Styling saltato per lock persistente sul file: %s (ultimo errore: %s)", path, last_exc)
-
-    # Scrivi i file richiesti con ATOMIC WRITE e applica styling
+        return _replace_with_retry(tmp, path, retries=retries, backoff_s=backoff_s)
+
+    # Scrivi i file richiesti con ATOMIC WRITE; il contenuto è identico, quindi se servono
+    # entrambi il latest è una copia (atomica) del versionato
     if ts_path is not None:
         ts_path = _atomic_write(ts_path)
-        _style_in_place(ts_path)
         log.info("Excel versionato (styled): %s", ts_path)
     if latest_path is not None:
-        latest_path = _atomic_write(latest_path)
-        _style_in_place(latest_path)
+        if ts_path is not None:
+            latest_path = copy_file_atomic(ts_path, latest_path)
+        else:
+            latest_path = _atomic_write(latest_path)
         log.info("Excel latest (styled): %s", latest_path)
 
     return ts_path, latest_path